@@ -1,22 +1,13 @@
-import pandas as pd
-from dotenv import find_dotenv, load_dotenv
-import os
-
 from queries import get_index_constituents, update_index_constituents
-
-dotenv_path = find_dotenv()
-
-if dotenv_path:
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-else:
-    print("No .env file found")
-
-INDEX_LIST = os.getenv('INDEX_LIST').split(',')
+from ema_state import invalidate_ema_state
+from price_store import read_store, write_store
+from indicator_cache import clear_disk_indicator_cache
+from settings import get_index_list
 
 def merge_col(new_name, old_name):
     
-    data = pd.read_csv("NSE_PRICE_DATA.csv")
-    volumes = pd.read_csv("NSE_VOLUME_DATA.csv")
+    data = read_store("NSE_PRICE_DATA.csv")
+    volumes = read_store("NSE_VOLUME_DATA.csv")
     
     if new_name not in data.columns:
         raise Exception(f'{new_name} does not exists in NSE Data')
@@ -32,10 +23,13 @@ def merge_col(new_name, old_name):
 
     volumes.drop(columns=[old_name], inplace=True)
 
-    data.to_csv("NSE_PRICE_DATA.csv", index=False)
-    volumes.to_csv("NSE_VOLUME_DATA.csv", index=False)
+    write_store(data, "NSE_PRICE_DATA.csv")
+    write_store(volumes, "NSE_VOLUME_DATA.csv")
+
+    invalidate_ema_state([new_name, old_name])
+    clear_disk_indicator_cache()
 
-    for index in INDEX_LIST:
+    for index in get_index_list():
         scrips = get_index_constituents(index)
         if old_name in scrips:
             old_name_index = scrips.index(old_name)
@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+
+from indicators import (calculate_ema, calculate_ttm_range, calculate_daily_change, calculate_m_score,
+                        calculate_coefficient_of_variation, build_month_index)
+from utils import check_dataframes, get_period_dates, get_scripts_sorted
+from eligibility import AsOfSnapshot, select_eligible, get_filters
+
+
+def calculate_scores(data, dates, start_year, start_month, end_year, end_month,
+                     sorting_criteria='ttm', absolute=False, lookback_months=12, prices=None):
+    '''
+    Sorting score of every stock for every month of the range at once, a (months x stocks)
+    DataFrame with 'Date' the first day of the month. Same scores as get_month_portfolio.
+
+    Parameters:
+    - data: DataFrame of prices with a 'Date' column, sorted by date.
+    - dates: Series of the dates of 'data'.
+    - sorting_criteria: 'ttm', 'm_score' or 'c_score'.
+    - absolute: Use only the negative daily changes for the m_score/c_score std.
+    - lookback_months: Length of the ttm window.
+    - prices: Optional float64 matrix of the stock columns of 'data', see calculate_ema.
+    '''
+    month_index = build_month_index(data, dates)
+    ttm = calculate_ttm_range(data, dates, start_year, start_month, end_year, end_month,
+                              lookback_months=lookback_months, month_index=month_index, prices=prices)
+
+    if sorting_criteria == 'ttm':
+        return ttm
+
+    daily_change = calculate_daily_change(data, dates, prices=prices)
+
+    if sorting_criteria == 'm_score':
+        return calculate_m_score(ttm, daily_change, lookback_months, absolute)
+
+    if sorting_criteria == 'c_score':
+        return calculate_coefficient_of_variation(ttm, daily_change, lookback_months, absolute)
+
+    raise ValueError(f'Unknown sorting_criteria: {sorting_criteria}')
+
+
+def get_backtest_trading_dates(dates_sorted, year, month):
+    '''
+    First, rollover and last trading dates of a month, taken from the dates of the data
+    instead of the holiday calendar. Returns None when the month has no dates or no date before it.
+    '''
+    start_date, end_date = get_period_dates(year, month)
+    month_dates = dates_sorted[(dates_sorted >= start_date) & (dates_sorted <= end_date)]
+    earlier_dates = dates_sorted[dates_sorted < start_date]
+
+    if len(month_dates) == 0 or len(earlier_dates) == 0:
+        return None
+
+    return month_dates.iloc[0], earlier_dates.iloc[-1], month_dates.iloc[-1]
+
+
+class PriceMatrix:
+    '''
+    Prices as a (dates x stocks) NumPy matrix with row/column lookups, so the month returns of
+    the backtest are array reads instead of a frame scan per stock and date. 'prices' is the
+    matrix of the stock columns of 'data' when already built, else it is copied out of 'data'.
+    '''
+
+    def __init__(self, data, prices=None):
+        self.stocks = [col for col in data.columns if col != 'Date']
+        self.columns = {stock: i for i, stock in enumerate(self.stocks)}
+        self.dates = pd.to_datetime(data['Date']).to_numpy()
+        self.rows = {date: i for i, date in enumerate(pd.to_datetime(data['Date']))}
+        self.prices = data[self.stocks].to_numpy(dtype=np.float64) if prices is None else prices
+
+    def adjust_price_if_zero(self, row, column):
+        '''
+        Same as utils.adjust_price_if_zero: the last non zero price on or before 'row'.
+        '''
+        non_zero = np.flatnonzero(self.prices[:row + 1, column] != 0)
+        return self.prices[non_zero[-1], column] if len(non_zero) > 0 else np.float64(0)
+
+
+def calculate_month_returns_matrix(prices, stocks, first_trading_date, roll_over_trading_date, last_trading_date,
+                                   carry_forward_scripts, price_tracking_enabled=False, sl=-10):
+    '''
+    utils.calculate_month_returns on a PriceMatrix: same return math, stop loss and output.
+
+    Returns (returns, stock_list, sl_triggered_stocks).
+    '''
+    first_row = prices.rows[first_trading_date]
+    roll_over_row = prices.rows[roll_over_trading_date]
+    last_row = prices.rows[last_trading_date]
+
+    returns = []
+    stock_list = []
+    sl_triggered_stocks = []
+    for stock in stocks:
+        column = prices.columns[stock]
+        carry_forward = stock in carry_forward_scripts
+        start_row = roll_over_row if carry_forward else first_row
+        sl_triggered = ''
+        sl_trigger_date = ''
+
+        initial_price = prices.prices[start_row, column]
+        if initial_price == 0:
+            initial_price = prices.adjust_price_if_zero(start_row, column)
+
+        if price_tracking_enabled:
+            monthly_prices = prices.prices[start_row:last_row + 1, column]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                perc_change = ((monthly_prices - initial_price)/initial_price)*100
+            triggered = np.flatnonzero(perc_change <= sl)
+
+            if len(triggered) == 0:
+                final_price = prices.prices[last_row, column]
+            else:
+                sl_triggered = True
+                sl_triggered_stocks.append(stock)
+                sl_trigger_date = pd.Timestamp(prices.dates[start_row + triggered[0]])
+                final_price = monthly_prices[triggered[0]]
+        else:
+            final_price = prices.prices[last_row, column]
+
+            if final_price == 0:
+                final_price = prices.adjust_price_if_zero(last_row, column)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stock_returns = ((final_price / initial_price) - 1) * 100
+
+        returns.append(stock_returns)
+        stock_list.append({
+            "stock": stock,
+            "initial_price": initial_price,
+            "final_price": final_price,
+            "returns": stock_returns,
+            "carry_forward": carry_forward,
+            "sl_triggered": sl_triggered,
+            "sl_trigger_date": '' if sl_trigger_date == '' else str(sl_trigger_date.date()),
+            "is_new": '' if carry_forward else 'NEW'
+        })
+
+    return returns, stock_list, sl_triggered_stocks
+
+
+def run_backtest(data, volumes,
+                 start_year=2010, start_month=1, end_year=None, end_month=None,
+                 top_n=[5, 10, 15, 20, 25, 30],
+                 sorting_criteria='ttm', absolute=False, lookback_months=12,
+                 price_tracking_enabled=False, stop_loss=0,
+                 filters=None, ema_timeframe=200, prices=None):
+    '''
+    In-memory backtest of a strategy over every month of the range, for several top N at once,
+    with no database.
+
+    Each month follows process_monthly_portfolio: the stocks are ranked by score, the first N
+    passing the eligibility filters at the rollover date are held, stocks held last month (and
+    not stopped out) are carried forward from the rollover date, new ones are bought at the
+    first trading date, and returns follow calculate_month_returns. The EMA, the scores of all
+    months (a months x stocks matrix) and the eligible ranking are computed once and shared by
+    every N. Trading dates are taken from the data.
+
+    Parameters:
+    - data: DataFrame of prices with a 'Date' column.
+    - volumes: DataFrame of volumes, same columns as 'data'.
+    - start_year, start_month, end_year, end_month: Months to run, both inclusive. The end
+      defaults to the last month of the data.
+    - top_n: Portfolio sizes to run.
+    - sorting_criteria, absolute, lookback_months: Score of the strategy, see calculate_scores.
+    - price_tracking_enabled, stop_loss: Stop loss of 'stop_loss' percent, as in get_month_portfolio.
+    - filters: Eligibility filter config (see eligibility.get_filters), the default filters when None.
+    - ema_timeframe: EMA used by the price_above_ema filter.
+    - prices: Optional float64 (dates x stocks) matrix of the stock columns of 'data', same rows
+      and column order, e.g. a read-only memory map (see sweep). Every indicator and the returns
+      read it instead of each copying the matrix out of 'data'. Built once from 'data' when None.
+
+    Returns the list create_excel and create_summary_data_frame expect, one item per N:
+    {'df': {f'{month}_{year}': month result}, 'top_n': N, 'sheet_name': f'Top_{N}'}.
+    '''
+    rows = len(data)
+    data, volumes, dates = check_dataframes(prices_df=data, volumes_df=volumes)
+
+    stocks = [col for col in data.columns if col != 'Date']
+    if prices is None:
+        prices = data[stocks].to_numpy(dtype=np.float64)
+    elif len(data) != rows or prices.shape != (len(data), len(stocks)):
+        raise ValueError('prices must have the rows of data and volumes and the stock columns of data')
+
+    # Row order is date order from here on (52 week high window, price matrix). Sorted input
+    # is used as is, so read-only shared matrices (see sweep) are not copied.
+    if not pd.to_datetime(data['Date']).is_monotonic_increasing:
+        order = np.argsort(pd.to_datetime(data['Date']).to_numpy(), kind='stable')
+        data = data.iloc[order].reset_index(drop=True)
+        volumes = volumes.iloc[order].reset_index(drop=True)
+        prices = prices[order]
+    dates = data['Date']
+
+    if end_year is None or end_month is None:
+        end_year, end_month = dates.iloc[-1].year, dates.iloc[-1].month
+
+    ema = calculate_ema(data=data, dates=dates, timeframe=ema_timeframe, prices=prices)
+    scores = calculate_scores(data, dates, start_year, start_month, end_year, end_month,
+                              sorting_criteria, absolute, lookback_months, prices=prices)
+    score_periods = set((d.year, d.month) for d in scores['Date'])
+
+    price_matrix = PriceMatrix(data, prices)
+    filters = get_filters(filters)
+    max_top_n = max(top_n)
+
+    results = {n: {} for n in top_n}
+    last_month = {n: {'top_n_scripts': [], 'sl_triggered_scripts': []} for n in top_n}
+
+    for period in range(start_year*12 + start_month - 1, end_year*12 + end_month):
+        year, month = period // 12, period % 12 + 1
+
+        trading_dates = get_backtest_trading_dates(dates, year, month)
+        if trading_dates is None or (year, month) not in score_periods:
+            continue
+        first_trading_date, roll_over_trading_date, last_trading_date = trading_dates
+
+        all_scripts = get_scripts_sorted(sorting_score=scores, year=year, month=month)
+        snapshot = AsOfSnapshot(data, volumes, [ema], roll_over_trading_date)
+        eligible_scripts = select_eligible(snapshot, all_scripts, max_top_n, filters)
+
+        for n in top_n:
+            top_n_scripts = eligible_scripts[:n]
+            last_month_scripts = last_month[n]['top_n_scripts']
+            last_month_sl_triggered_scripts = last_month[n]['sl_triggered_scripts']
+
+            carry_forward_scripts = [
+                script for script in top_n_scripts
+                if script in last_month_scripts and script not in last_month_sl_triggered_scripts
+            ]
+            new_added_scripts = [script for script in top_n_scripts if script not in last_month_scripts]
+            removed_scripts = [script for script in last_month_scripts if script not in top_n_scripts]
+
+            returns, portfolio, sl_triggered_scripts = calculate_month_returns_matrix(
+                price_matrix, top_n_scripts, first_trading_date, roll_over_trading_date, last_trading_date,
+                carry_forward_scripts, price_tracking_enabled, sl=stop_loss*-1)
+
+            month_result = {
+                'year': year,
+                'month': month,
+                'start_date': get_period_dates(year, month)[0],
+                'end_date': get_period_dates(year, month)[1],
+                'first_trading_date': first_trading_date,
+                'last_trading_date': last_trading_date,
+                'roll_over_trading_date': roll_over_trading_date,
+                'top_n_scripts': top_n_scripts,
+                'sl_triggered_scripts': sl_triggered_scripts,
+                'monthly_returns': float(np.mean(returns)) if len(returns) > 0 else 0,
+                'top_n_monthly_returns': returns,
+                'scripts_with_returns': dict(zip(top_n_scripts, returns)),
+                'last_month_30': last_month_scripts,
+                'new_added_scripts': new_added_scripts,
+                'removed_scripts': removed_scripts,
+                'carry_forward_scripts': carry_forward_scripts,
+                'portfolio': portfolio
+            }
+
+            results[n][f'{month}_{year}'] = month_result
+            last_month[n] = month_result
+
+    return [{'df': results[n], 'top_n': n, 'sheet_name': f'Top_{n}'} for n in top_n]
+
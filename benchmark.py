@@ -0,0 +1,212 @@
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from indicators import calculate_ema
+from utils import front_fill_stock_prices
+
+
+def make_synthetic_prices(rows=4000, columns=2500, seed=42):
+    '''
+    Builds a wide price frame shaped like NSE_PRICE_DATA.csv: a 'Date' column
+    followed by one random-walk price column per stock.
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start='2010-01-01', periods=rows)
+    returns = rng.normal(loc=0.0005, scale=0.02, size=(rows, columns))
+    prices = 100 * np.exp(np.cumsum(returns, axis=0))
+    data = pd.DataFrame(prices, columns=[f'STOCK{i}' for i in range(columns)])
+    data.insert(0, 'Date', dates)
+    return data
+
+
+def calculate_ema_loop(data, dates, timeframe=200):
+    '''
+    The original per-date, per-stock EMA loop, kept here as the benchmark baseline.
+    '''
+    alpha = 2/(timeframe + 1)
+    initial_ema = data[data['Date'].isin(dates[:timeframe])].mean().to_dict()
+    initial_ema['Date'] = dates[timeframe-1]
+    initial_ema = [initial_ema]
+
+    stocks = list(filter(lambda x: x not in ['Date'], list((data.columns))))
+
+    for i, date in enumerate(dates[timeframe:], start=timeframe):
+        date_dict = {}
+        date_dict['Date'] = date
+        for stock in stocks:
+            closing_price = data.loc[i, stock]
+            previous_ema = initial_ema[i-timeframe][stock]
+            current_ema = (closing_price * alpha) + (previous_ema * (1 - alpha))
+            date_dict[stock] = current_ema
+        initial_ema.append(date_dict)
+
+    return pd.DataFrame(initial_ema)
+
+
+def benchmark_ema(rows=4000, columns=2500, baseline_columns=25, timeframe=200):
+    '''
+    Times the vectorized calculate_ema on the full synthetic matrix against the old loop.
+
+    The loop is far too slow to run on 2,500 columns, so it is timed on the first
+    'baseline_columns' stocks and scaled linearly (its cost is proportional to the
+    number of columns). Both results are compared on the shared columns.
+    '''
+    data = make_synthetic_prices(rows=rows, columns=columns)
+    dates = data['Date']
+
+    start = time.perf_counter()
+    ema = calculate_ema(data=data, dates=dates, timeframe=timeframe)
+    vectorized_seconds = time.perf_counter() - start
+
+    baseline_data = data.iloc[:, :baseline_columns + 1]
+    start = time.perf_counter()
+    baseline_ema = calculate_ema_loop(data=baseline_data, dates=dates, timeframe=timeframe)
+    loop_seconds = (time.perf_counter() - start) * (columns / baseline_columns)
+
+    max_abs_diff = np.abs(ema[baseline_data.columns[1:]].to_numpy() - baseline_ema[baseline_data.columns[1:]].to_numpy()).max()
+
+    print(f'EMA {timeframe} on {rows} rows x {columns} columns')
+    print(f'vectorized: {vectorized_seconds:.3f}s')
+    print(f'loop (scaled from {baseline_columns} columns): {loop_seconds:.1f}s')
+    print(f'speedup: {loop_seconds / vectorized_seconds:.0f}x, max abs diff: {max_abs_diff:.3e}')
+
+    return vectorized_seconds, loop_seconds
+
+
+def make_gappy_prices(rows=4000, columns=2500, seed=42):
+    '''
+    Synthetic prices with the gaps of the real data: zeros before a stock's listing
+    and scattered missing/zero days afterwards.
+    '''
+    rng = np.random.default_rng(seed)
+    data = make_synthetic_prices(rows=rows, columns=columns, seed=seed)
+    prices = data.iloc[:, 1:].to_numpy()
+
+    listing_rows = rng.integers(0, rows, size=columns)
+    prices[np.arange(rows)[:, None] < listing_rows] = 0
+    prices[rng.random(prices.shape) < 0.02] = np.nan
+    prices[rng.random(prices.shape) < 0.01] = 0
+
+    data.iloc[:, 1:] = prices
+    return data
+
+
+def front_fill_stock_prices_apply(df):
+    '''
+    The original pd.NA / DataFrame.apply forward fill, kept here as the benchmark baseline.
+    '''
+    df.set_index('Date', inplace=True)
+    df = df.replace(0, pd.NA)
+    filled_df = df.apply(lambda x: x.ffill())
+    filled_df = filled_df.fillna(0)
+    filled_df.reset_index(inplace=True)
+    return filled_df
+
+
+def _time_and_peak_memory(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak_bytes
+
+
+def benchmark_forward_fill(rows=4000, columns=2500):
+    '''
+    Times and measures the peak memory of front_fill_stock_prices against the old
+    pd.NA / apply implementation on a realistic wide price frame.
+    '''
+    data = make_gappy_prices(rows=rows, columns=columns)
+
+    new_df, new_seconds, new_peak = _time_and_peak_memory(front_fill_stock_prices, data.copy())
+    old_df, old_seconds, old_peak = _time_and_peak_memory(front_fill_stock_prices_apply, data.copy())
+
+    matches = np.array_equal(new_df.iloc[:, 1:].to_numpy(dtype=np.float64), old_df.iloc[:, 1:].to_numpy(dtype=np.float64))
+
+    print(f'forward fill on {rows} rows x {columns} columns')
+    print(f'vectorized: {new_seconds:.3f}s, peak {new_peak / 1024**2:.0f} MB')
+    print(f'apply: {old_seconds:.3f}s, peak {old_peak / 1024**2:.0f} MB')
+    print(f'speedup: {old_seconds / new_seconds:.0f}x, same result: {matches}')
+
+    return new_seconds, old_seconds
+
+
+# Cumulative `python -X importtime` budget in ms per entry point, and the modules it must not
+# import: the computational core does no I/O at import, the scripts load yfinance/Mongo lazily.
+# The forbidden imports are checked by test_import_budget.py; the ms budgets depend on the
+# machine and are only reported by benchmark_import_times, next to the `import pandas` baseline.
+IMPORT_BUDGETS = {
+    'indicators': (800, ('pymongo', 'dotenv', 'yfinance', 'openpyxl', 'queries')),
+    'utils': (800, ('pymongo', 'dotenv', 'yfinance', 'openpyxl', 'queries')),
+    'monthly_portfolio_builder': (900, ('pymongo', 'dotenv', 'yfinance', 'openpyxl', 'queries')),
+    'monthly_orders': (1200, ('dotenv', 'yfinance', 'openpyxl')),
+    'momentum_all': (1200, ('dotenv', 'yfinance', 'openpyxl')),
+    'order_executions': (1200, ('dotenv', 'yfinance', 'openpyxl')),
+}
+
+
+def measure_import_time(module, runs=3):
+    '''
+    Imports 'module' in a fresh interpreter under `python -X importtime` and returns the best
+    cumulative import time in ms over 'runs', and the modules loaded by the import.
+    '''
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    best_ms = None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import sys, {module}; print(",".join(sys.modules))'],
+                                cwd=repo_dir, capture_output=True, text=True, check=True)
+        lines = [line for line in result.stderr.splitlines() if line.split('|')[-1].strip() == module]
+        cumulative_ms = int(lines[-1].split('|')[1]) / 1000
+        best_ms = cumulative_ms if best_ms is None else min(best_ms, cumulative_ms)
+
+    return best_ms, set(result.stdout.strip().split(','))
+
+
+def check_forbidden_imports(budgets=IMPORT_BUDGETS):
+    '''
+    Checks that no entry point imports one of its forbidden modules.
+    Raises an AssertionError listing the entry points that do.
+    '''
+    failures = {}
+    for module, (_, forbidden) in budgets.items():
+        _, loaded = measure_import_time(module, runs=1)
+        forbidden_loaded = sorted(set(forbidden) & loaded)
+        if len(forbidden_loaded) > 0:
+            failures[module] = forbidden_loaded
+
+    assert len(failures) == 0, f'Forbidden imports: {failures}'
+    return True
+
+
+def benchmark_import_times(budgets=IMPORT_BUDGETS, runs=3):
+    '''
+    Reports the import time of every entry point against its ms budget, with the time of a bare
+    `import pandas` on the same machine as the baseline. Nothing is asserted.
+
+    Returns {module: import ms}.
+    '''
+    pandas_ms, _ = measure_import_time('pandas', runs=runs)
+    print(f'import pandas: {pandas_ms:.0f}ms')
+
+    import_times = {}
+    for module, (budget_ms, _) in budgets.items():
+        import_ms, _ = measure_import_time(module, runs=runs)
+        import_times[module] = import_ms
+        status = 'over budget' if import_ms > budget_ms else 'ok'
+        print(f'{module}: {import_ms:.0f}ms ({import_ms / pandas_ms:.1f}x pandas), budget {budget_ms}ms, {status}')
+
+    return import_times
+
+
+if __name__ == '__main__':
+    benchmark_ema()
+    benchmark_forward_fill()
+    benchmark_import_times()
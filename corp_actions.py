@@ -1,24 +1,16 @@
-from dotenv import find_dotenv, load_dotenv
 from datetime import datetime, timedelta
-import os
 import re
-import pandas as pd
 
 from NSE_Selenium_login import get_data_with_selenium_nse_api
 
 from queries import save_corp_action, save_all_corp_action, get_adjusted_corp_actions
-
-dotenv_path = find_dotenv()
-
-if dotenv_path:
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-else:
-    print("No .env file found")
-
-NSE_base_url = os.getenv('NSE_base_url')
+from ema_state import invalidate_ema_state
+from price_store import read_store, write_store
+from indicator_cache import clear_disk_indicator_cache
+from settings import get_env
 
 def read_data(csv):
-    df = pd.read_csv(csv, parse_dates=['Date'])
+    df = read_store(csv)
     df = df.loc[:, ~(df.columns.str.contains('^Unnamed') | df.columns.isnull())].copy()
     df.dropna(axis=1, how='all', inplace=True)
     df.dropna(axis=0, how='all', inplace=True)
@@ -94,7 +86,7 @@ def get_corp_actions(date = datetime.now()):
         date = date.date().strftime('%d-%m-%Y')
         print(date)
         endpoint = f'/api/corporates-corporateActions?index=equities&from_date={date}&to_date={date}'
-        all_corp_actions = get_data_with_selenium_nse_api(NSE_base_url, endpoint)
+        all_corp_actions = get_data_with_selenium_nse_api(get_env('NSE_base_url'), endpoint)
         corp_actions, dates = filter_and_enrich_json(all_corp_actions)
         all_corp_actions = {
             'created_on': datetime.now(),
@@ -118,12 +110,13 @@ def get_corp_actions(date = datetime.now()):
 def adjust_price_and_volumes(corp_actions):
     try:
         index = 'NSE'
-        pd_path = os.getenv(f'{index}_PRICE_DATA')
-        vd_path = os.getenv(f'{index}_VOLUME_DATA')
+        pd_path = get_env(f'{index}_PRICE_DATA')
+        vd_path = get_env(f'{index}_VOLUME_DATA')
         print(pd_path, vd_path)
         pdf = read_data(pd_path)
         vdf = read_data(vd_path)
         columns = list(pdf.columns)
+        adjusted_stocks = []
         for action in corp_actions['actions']:
             stock = action['symbol']
             date = action['exDate']
@@ -132,10 +125,17 @@ def adjust_price_and_volumes(corp_actions):
             if stock in columns:
                 pdf.loc[pdf['Date'] < date, stock] = pdf.loc[pdf['Date'] < date, stock] / div_value
                 vdf.loc[vdf['Date'] < date, stock] = (vdf.loc[vdf['Date'] < date, stock] * div_value).round(0)
+                adjusted_stocks.append(stock)
+
+        if adjusted_stocks:
+            write_store(pdf, pd_path)
+            write_store(vdf, vd_path)
+
+            invalidate_ema_state(adjusted_stocks)
+            clear_disk_indicator_cache()
+        else:
+            print('No corp action stocks in the price data, nothing to adjust')
 
-            pdf.to_csv(pd_path, index=False)
-            vdf.to_csv(vd_path, index=False)
-        
         return True
     except Exception as e:
         print(str(e))
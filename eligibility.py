@@ -0,0 +1,314 @@
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+
+class AsOfSnapshot:
+    '''
+    Inputs of the eligibility filters at one rollover date, shared by every filter.
+
+    Each input is a vector aligned to 'stocks' (the price columns), so a filter is a boolean
+    mask instead of a frame scan per stock. Inputs are computed lazily, only for the stock
+    positions asked for, and cached, so a filter run on the top ranked candidates only never
+    touches the rest of the universe.
+
+    Parameters:
+    - data: DataFrame of prices with a 'Date' column.
+    - volumes: DataFrame of volumes, same columns and rows as 'data'.
+    - ema_list: List of EMA DataFrames with a 'Date' column.
+    - as_of_date: The rollover trading date.
+    - high_lookback_rows: Rows (trading days) of the 52 week high window.
+    '''
+
+    def __init__(self, data, volumes, ema_list, as_of_date, high_lookback_rows=250):
+        self.data = data
+        self.volumes = volumes
+        self.ema_list = ema_list
+        self.as_of_date = pd.to_datetime(as_of_date)
+        self.high_lookback_rows = high_lookback_rows
+        self.stocks = [col for col in data.columns if col != 'Date']
+        self.positions = {stock: i for i, stock in enumerate(self.stocks)}
+        self._inputs = {}
+
+    def index_of(self, stocks):
+        return np.array([self.positions[stock] for stock in stocks], dtype=np.intp)
+
+    def get_inputs(self, names, positions=None):
+        '''
+        Values of the inputs 'names' at 'positions', as a dict of {name: values}.
+        '''
+        return {name: getattr(self, name)(positions) for name in names}
+
+    def _input(self, name, positions, compute):
+        '''
+        Values of input 'name' at 'positions' (all stocks when None). 'compute(positions)' is
+        only called for the positions not computed yet.
+        '''
+        if positions is None:
+            positions = np.arange(len(self.stocks))
+
+        if name not in self._inputs:
+            self._inputs[name] = (np.full(len(self.stocks), np.nan), np.zeros(len(self.stocks), dtype=bool))
+        values, computed = self._inputs[name]
+
+        missing = np.unique(positions[~computed[positions]])
+        if len(missing) > 0:
+            values[missing] = compute(missing)
+            computed[missing] = True
+
+        return values[positions]
+
+    @cached_property
+    def _data_columns(self):
+        return self.data.columns.get_indexer(self.stocks)
+
+    @cached_property
+    def _date_values(self):
+        return pd.to_datetime(self.data['Date']).to_numpy()
+
+    @cached_property
+    def as_of_row(self):
+        rows = np.flatnonzero(self._date_values == self.as_of_date.to_datetime64())
+        if len(rows) == 0:
+            raise ValueError("roll_over_trading_date not found in data or one of the EMA DataFrames.")
+        return rows[0]
+
+    @cached_property
+    def _ema_rows(self):
+        ema_rows = []
+        for ema in self.ema_list:
+            rows = np.flatnonzero(pd.to_datetime(ema['Date']).to_numpy() == self.as_of_date.to_datetime64())
+            if len(rows) == 0:
+                raise ValueError("roll_over_trading_date not found in data or one of the EMA DataFrames.")
+            ema_rows.append((rows[0], ema.columns.get_indexer(self.stocks)))
+        return ema_rows
+
+    @cached_property
+    def _high_rows(self):
+        return np.flatnonzero(self._date_values <= self.as_of_date.to_datetime64())[-self.high_lookback_rows:]
+
+    @cached_property
+    def _month_rows(self):
+        dates = pd.to_datetime(self.data['Date'])
+        volume_dates = pd.to_datetime(self.volumes['Date'])
+        in_month = (dates.dt.month == self.as_of_date.month) & (dates.dt.year == self.as_of_date.year)
+        volumes_in_month = (volume_dates.dt.month == self.as_of_date.month) & (volume_dates.dt.year == self.as_of_date.year)
+        return np.flatnonzero(in_month.to_numpy()), np.flatnonzero(volumes_in_month.to_numpy())
+
+    def price(self, positions=None):
+        return self._input('price', positions,
+                           lambda p: self.data.iloc[self.as_of_row, self._data_columns[p]].to_numpy(dtype=np.float64))
+
+    def ema(self, positions=None):
+        '''
+        One vector per EMA frame, the EMA values at the as-of date.
+        '''
+        return [self._input(f'ema_{i}', positions,
+                            lambda p, row=row, columns=columns: ema.iloc[row, columns[p]].to_numpy(dtype=np.float64))
+                for i, (ema, (row, columns)) in enumerate(zip(self.ema_list, self._ema_rows))]
+
+    def high_52wk(self, positions=None):
+        '''
+        Max price over the last 'high_lookback_rows' rows dated on or before the as-of date.
+        '''
+        return self._input('high_52wk', positions,
+                           lambda p: self.data.iloc[self._high_rows, self._data_columns[p]].max().to_numpy(dtype=np.float64))
+
+    def avg_traded_value(self, positions=None):
+        '''
+        Mean daily traded value (price x volume) over the month of the as-of date.
+        '''
+        def compute(p):
+            month_rows, volume_month_rows = self._month_rows
+            stocks = [self.stocks[i] for i in p]
+            traded_value = self.data.iloc[month_rows][stocks] * self.volumes.iloc[volume_month_rows][stocks]
+            return traded_value.mean().to_numpy(dtype=np.float64)
+
+        return self._input('avg_traded_value', positions, compute)
+
+
+class EligibilityFilter:
+    '''
+    An eligibility filter of the registry.
+
+    Parameters:
+    - name: Registry name, used in strategy configs and rejection reports.
+    - mask: Function (inputs, **params) returning one bool per candidate, 'inputs' the dict of
+      the declared input values of the candidates.
+    - inputs: Names of the AsOfSnapshot inputs the mask reads, e.g. ('price', 'high_52wk').
+      Only these are computed for and passed to the mask. Inputs are cached by the snapshot,
+      so an input declared by several filters is computed once per candidate.
+    - cost: Relative cost per candidate, cheaper filters run first.
+    - params: Default parameters (thresholds), overridden by the strategy config.
+    '''
+
+    def __init__(self, name, mask, inputs, cost, params=None):
+        self.name = name
+        self.mask = mask
+        self.inputs = tuple(inputs)
+        self.cost = cost
+        self.params = params or {}
+
+    def configure(self, **params):
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)} for filter '{self.name}'")
+        return EligibilityFilter(self.name, self.mask, self.inputs, self.cost, {**self.params, **params})
+
+    def __call__(self, snapshot, positions=None):
+        return np.asarray(self.mask(snapshot.get_inputs(self.inputs, positions), **self.params), dtype=bool)
+
+    def __repr__(self):
+        return f'EligibilityFilter({self.name}, {self.params})'
+
+
+FILTER_REGISTRY = {}
+
+
+def register_filter(name, inputs, cost, **params):
+    '''
+    Decorator registering a mask function as eligibility filter 'name'. Keyword arguments are
+    the default parameters of the filter.
+    '''
+    for input_name in inputs:
+        if not callable(getattr(AsOfSnapshot, input_name, None)):
+            raise ValueError(f"Unknown snapshot input '{input_name}' for filter '{name}'")
+
+    def decorator(mask):
+        FILTER_REGISTRY[name] = EligibilityFilter(name, mask, inputs, cost, params)
+        return mask
+
+    return decorator
+
+
+# Costs: the EMA check reads one row, the traded value a month of rows from two frames,
+# the 52 week high 250 rows
+@register_filter('price_above_ema', inputs=('price', 'ema'), cost=1)
+def price_above_ema_mask(inputs):
+    '''
+    Vectorized price_above_ema: the price is above every EMA. A NaN EMA does not reject.
+    '''
+    price = inputs['price']
+    mask = np.ones(len(price), dtype=bool)
+    for ema_values in inputs['ema']:
+        mask &= ~(price <= ema_values)
+    return mask
+
+
+@register_filter('price_above_52WKH', inputs=('price', 'high_52wk'), cost=3, factor=0.7)
+def price_above_52WKH_mask(inputs, factor=0.7):
+    '''
+    Vectorized price_above_52WKH: the price is above 'factor' times the 52 week high.
+    '''
+    return inputs['price'] > inputs['high_52wk'] * factor
+
+
+@register_filter('volume_check', inputs=('avg_traded_value',), cost=2, min_volume=10000000)
+def volume_check_mask(inputs, min_volume=10000000):
+    '''
+    Vectorized volume_check: the month's average daily traded value is above 'min_volume'.
+    '''
+    return inputs['avg_traded_value'] > min_volume
+
+
+# Filters of the V1-V4 strategies
+DEFAULT_FILTERS = [
+    {'name': 'price_above_ema'},
+    {'name': 'price_above_52WKH', 'params': {'factor': 0.7}},
+    {'name': 'volume_check', 'params': {'min_volume': 10000000}},
+]
+
+
+def get_filters(config=None):
+    '''
+    Builds the filters of a strategy config from the registry.
+
+    Parameters:
+    - config: List of filter names or {'name': ..., 'params': {...}} dicts, DEFAULT_FILTERS when None.
+    '''
+    filters = []
+    for item in DEFAULT_FILTERS if config is None else config:
+        if isinstance(item, EligibilityFilter):
+            filters.append(item)
+            continue
+
+        name, params = (item, {}) if isinstance(item, str) else (item['name'], item.get('params', {}))
+        if name not in FILTER_REGISTRY:
+            raise ValueError(f"Unknown eligibility filter '{name}'")
+        filters.append(FILTER_REGISTRY[name].configure(**params))
+
+    return filters
+
+
+_filter_report_hook = None
+
+
+def set_filter_report_hook(hook):
+    '''
+    Sets the callable receiving the stats of every select_eligible run (see select_eligible),
+    e.g. print_filter_report. None disables reporting.
+    '''
+    global _filter_report_hook
+    _filter_report_hook = hook
+
+
+def print_filter_report(stats):
+    rejected = ', '.join(f'{name}: {count}' for name, count in stats['rejected'].items())
+    print(f"rollover_trading_date: {stats['roll_over_trading_date']}, top n: {stats['number_of_stocks']}, "
+          f"checked: {stats['checked']} of {stats['candidates']}, selected: {stats['selected']}, rejected by {rejected}")
+
+
+def select_eligible(snapshot, ranked_stocks, number_of_stocks, filters, chunk_size=None):
+    '''
+    Walks the ranked stocks in score order and returns the first 'number_of_stocks' that pass
+    every filter. Same result as filtering the whole ranking and slicing, but candidates are
+    checked a chunk at a time, cheapest filter first, and the walk stops at N survivors.
+    Each filter's declared inputs are computed only for the candidates still alive when it runs.
+
+    Per-filter rejection counts are sent to the filter report hook as a dict with
+    'roll_over_trading_date', 'number_of_stocks', 'candidates', 'checked', 'selected' and
+    'rejected' ({filter name: count}).
+
+    Parameters:
+    - snapshot: AsOfSnapshot at the rollover date.
+    - ranked_stocks: Stocks in score order, best first.
+    - number_of_stocks: Number of stocks to select.
+    - filters: Filter config (see get_filters) or list of EligibilityFilter.
+    - chunk_size: Candidates checked per step, twice the number still needed when None.
+    '''
+    filters = sorted(get_filters(filters), key=lambda f: f.cost)
+    rejected = {f.name: 0 for f in filters}
+    selected = []
+    checked = 0
+
+    while len(selected) < number_of_stocks and checked < len(ranked_stocks):
+        size = chunk_size or 2 * (number_of_stocks - len(selected))
+        chunk = ranked_stocks[checked:checked + size]
+        checked += len(chunk)
+
+        positions = snapshot.index_of(chunk)
+        alive = np.ones(len(chunk), dtype=bool)
+        for eligibility_filter in filters:
+            candidates = np.flatnonzero(alive)
+            if len(candidates) == 0:
+                break
+            passed = eligibility_filter(snapshot, positions[candidates])
+            rejected[eligibility_filter.name] += int((~passed).sum())
+            alive[candidates[~passed]] = False
+
+        selected.extend(stock for stock, is_alive in zip(chunk, alive) if is_alive)
+
+    selected = selected[:number_of_stocks]
+
+    if _filter_report_hook is not None:
+        _filter_report_hook({
+            'roll_over_trading_date': snapshot.as_of_date,
+            'number_of_stocks': number_of_stocks,
+            'candidates': len(ranked_stocks),
+            'checked': checked,
+            'selected': len(selected),
+            'rejected': rejected
+        })
+
+    return selected
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from settings import get_env
+
+
+def get_ema_state_path():
+    return get_env('EMA_STATE_PATH', 'EMA_STATE.json')
+
+
+def _read_state_file(path):
+    '''
+    Reads the state file. A missing, unreadable or corrupt file is empty state, so every EMA
+    is computed from the seed window and the file is rewritten on the next save.
+    '''
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, 'r') as state_file:
+            stored = json.load(state_file)
+    except (OSError, ValueError) as e:
+        print(f'Ignoring unreadable EMA state file {path}: {e}')
+        return {}
+
+    return stored if isinstance(stored, dict) else {}
+
+
+def _write_state_file(state, path):
+    '''
+    Writes the state to a unique temporary file in the same directory and moves it over 'path',
+    so concurrent writers never share a temporary file and readers never see a partial file.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.ema_state_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as state_file:
+            json.dump(state, state_file, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_ema_state(timeframe=200, path=None):
+    '''
+    Loads the last EMA value per stock, and the date it was computed to, for one timeframe.
+
+    Returns a dict of {stock: {'ema': float, 'date': pd.Timestamp}}. A missing or corrupt
+    file means empty state.
+    '''
+    path = path or get_ema_state_path()
+    stored = _read_state_file(path).get(str(timeframe), {})
+
+    return {stock: {'ema': item['ema'], 'date': pd.Timestamp(item['date'])} for stock, item in stored.items()}
+
+
+def save_ema_state(ema_state, timeframe=200, path=None):
+    '''
+    Merges the given per-stock EMA state into the state file. Stocks not present in 'ema_state'
+    (e.g. constituents of another index) are kept as they are.
+    '''
+    path = path or get_ema_state_path()
+    stored = _read_state_file(path)
+    timeframe_state = stored.setdefault(str(timeframe), {})
+
+    for stock, item in ema_state.items():
+        timeframe_state[stock] = {'ema': float(item['ema']), 'date': pd.Timestamp(item['date']).strftime('%Y-%m-%d')}
+
+    _write_state_file(stored, path)
+    return True
+
+
+def invalidate_ema_state(stocks, path=None):
+    '''
+    Drops the saved EMA of the given stocks for every timeframe. Must be called whenever a stock's
+    price history is rewritten (corporate action adjustment, name change merge), so that its EMA
+    is recomputed from the seed window on the next run.
+    '''
+    path = path or get_ema_state_path()
+    stored = _read_state_file(path)
+    if not stored:
+        return True
+
+    for timeframe_state in stored.values():
+        for stock in stocks:
+            timeframe_state.pop(stock, None)
+
+    _write_state_file(stored, path)
+    return True
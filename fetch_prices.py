@@ -1,7 +1,84 @@
-import yfinance as yf
 from datetime import datetime, timedelta, time
+import os
+import threading
+import numpy as np
 import pandas as pd
 
+from settings import get_env
+
+# Map exchange to symbol format
+EXCHANGE_SUFFIX = {
+    'NSE': '.NS',  # NSE (India)
+    'BSE': '.BO',  # BSE (India)
+    'NYSE': '',    # NYSE (default format)
+    'NASDAQ': '',  # NASDAQ (default format)
+}
+
+# yf.download keeps its results in module globals reset on every call, so concurrent downloads
+# can drop or mix up tickers. Every download goes through this lock.
+_download_lock = threading.Lock()
+
+
+def download_bars(tickers, **kwargs):
+    import yfinance as yf
+    with _download_lock:
+        return yf.download(tickers, **kwargs)
+
+
+def find_bar_price(stock_data, symbol, target_datetime, max_iterations = 10):
+    """
+    Returns the Open of the first 1-minute bar at or after the target datetime, if it starts within
+    max_iterations minutes of it, or a message if no bar is found.
+
+    :param stock_data: DataFrame of 1-minute bars with an 'Open' column and a sorted, naive Asia/Kolkata index
+    """
+    position = stock_data.index.searchsorted(pd.Timestamp(target_datetime), side='left')
+
+    if position < len(stock_data) and stock_data.index[position] < target_datetime + timedelta(minutes=max_iterations):
+        return stock_data['Open'].iloc[position]
+
+    return f"No exact match for {symbol} at {target_datetime + timedelta(minutes=max_iterations)}"
+
+
+def get_intraday_cache_dir():
+    return get_env('INTRADAY_CACHE_DIR', 'intraday_cache')
+
+
+class IntradayBarCache:
+    """
+    On-disk cache of the 1-minute bars of a symbol for a day, one .npz file per (symbol, date), so
+    re-running an execution or a reconciliation for the same day needs no refetch.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or get_intraday_cache_dir()
+
+    def _path(self, symbol, day):
+        return os.path.join(self.cache_dir, f"{day.strftime('%Y-%m-%d')}_{symbol}.npz")
+
+    def get(self, symbol, day):
+        path = self._path(symbol, day)
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path, allow_pickle=False) as stored:
+            return pd.DataFrame(stored['values'], columns=stored['columns'].tolist(), index=pd.DatetimeIndex(stored['times']))
+
+    def put(self, symbol, day, bars):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(symbol, day)
+        bars = bars.sort_index()
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as cache_file:
+            np.savez(cache_file,
+                     times=bars.index.to_numpy(dtype='datetime64[ns]'),
+                     columns=np.array(bars.columns, dtype=str),
+                     values=bars.to_numpy(dtype=np.float64))
+        os.replace(tmp_path, path)
+        return True
+
+
 def get_stock_price(symbol, target_datetime, exchange='NSE', max_iterations = 10):
     """
     Fetches the stock price of a given symbol at a specific datetime, with support for specific exchanges.
@@ -11,17 +88,9 @@ def get_stock_price(symbol, target_datetime, exchange='NSE', max_iterations = 10
     :param exchange: Stock exchange (default is 'NSE')
     :return: Stock price (Open, High, Low, Close) or a message if not found
     """
-    # Map exchange to symbol format
-    exchange_suffix = {
-        'NSE': '.NS',  # NSE (India)
-        'BSE': '.BO',  # BSE (India)
-        'NYSE': '',    # NYSE (default format)
-        'NASDAQ': '',  # NASDAQ (default format)
-    }
-
     # Append the correct suffix to the symbol based on the exchange
-    if exchange in exchange_suffix:
-        symbol += exchange_suffix[exchange]
+    if exchange in EXCHANGE_SUFFIX:
+        symbol += EXCHANGE_SUFFIX[exchange]
     else:
         return f"Exchange '{exchange}' is not supported."
 
@@ -32,7 +101,7 @@ def get_stock_price(symbol, target_datetime, exchange='NSE', max_iterations = 10
     start_date = target_datetime.strftime("%Y-%m-%d")
     end_date = (target_datetime + timedelta(days=1)).strftime("%Y-%m-%d")
     # Fetch data from Yahoo Finance
-    stock_data = yf.download(symbol, start=start_date, end=end_date, interval='1m')
+    stock_data = download_bars(symbol, start=start_date, end=end_date, interval='1m')
 
     if stock_data.empty:
         return f"No data found for {symbol} on {target_datetime}"
@@ -40,18 +109,128 @@ def get_stock_price(symbol, target_datetime, exchange='NSE', max_iterations = 10
     # Look for the closest timestamp to the target datetime
     # print(stock_data.index) # Remove timezone for comparison
     stock_data.index = stock_data.index.tz_convert('Asia/Kolkata').tz_localize(None)
-    
-    for _ in range(max_iterations):
-        target_row = stock_data.loc[stock_data.index == target_datetime]
+    stock_data = stock_data.sort_index()
+
+    if isinstance(stock_data.columns, pd.MultiIndex):
+        stock_data = stock_data.xs(symbol, axis=1, level='Ticker')
+
+    return find_bar_price(stock_data, symbol, target_datetime, max_iterations)
+
+
+class PriceProvider:
+    """
+    Interface of the execution price sources used by order_executions.
+
+    prefetch() is given every symbol needed for a run up front so a provider can load them in one
+    request, get_price() then serves single lookups. get_price returns the price, or a message
+    string when no price is found, like get_stock_price.
+    """
+
+    def prefetch(self, symbols, target_datetime):
+        pass
+
+    def get_price(self, symbol, target_datetime):
+        raise NotImplementedError
+
+
+class YahooBatchPriceProvider(PriceProvider):
+    """
+    Fetches the 1-minute bars of all symbols of a day with one multi-ticker yf.download call.
+
+    With a 'bar_cache', bars already on disk are reused as long as they reach the target time,
+    and every download is written back to it.
+    """
+
+    def __init__(self, exchange='NSE', max_iterations = 10, bar_cache=None):
+        if exchange not in EXCHANGE_SUFFIX:
+            raise Exception(f"Exchange '{exchange}' is not supported.")
+        self.suffix = EXCHANGE_SUFFIX[exchange]
+        self.max_iterations = max_iterations
+        self.bar_cache = bar_cache
+        self._bars = {}
+
+    def _load_cached(self, symbol, target_datetime):
+        day = target_datetime.date()
+        bars = self._bars.get((symbol, day))
+        if bars is None and self.bar_cache is not None:
+            bars = self.bar_cache.get(symbol, day)
+
+        # Bars fetched earlier in the day may end before the target time, those are refetched
+        if bars is None or bars.empty or bars.index[-1] < target_datetime:
+            return False
+
+        self._bars[(symbol, day)] = bars
+        return True
+
+    def prefetch(self, symbols, target_datetime):
+        day = target_datetime.date()
+        symbols = sorted(set(s for s in symbols if not self._load_cached(s, target_datetime)))
+        if len(symbols) == 0:
+            return
 
-        if not target_row.empty:
-            print(target_row)
-            return target_row.iloc[0].loc['Open'].values[0]  # Return the closing price if found
+        tickers = [symbol + self.suffix for symbol in symbols]
+        start_date = target_datetime.strftime("%Y-%m-%d")
+        end_date = (target_datetime + timedelta(days=1)).strftime("%Y-%m-%d")
+        stock_data = download_bars(tickers, start=start_date, end=end_date, interval='1m', group_by='ticker', threads=True)
 
-        # Increment the target_datetime by one minute
-        target_datetime += timedelta(minutes=1)
+        if not stock_data.empty:
+            stock_data.index = stock_data.index.tz_convert('Asia/Kolkata').tz_localize(None)
 
-    return f"No exact match for {symbol} at {target_datetime}"
+        for symbol, ticker in zip(symbols, tickers):
+            if stock_data.empty or (isinstance(stock_data.columns, pd.MultiIndex) and ticker not in stock_data.columns.get_level_values(0)):
+                bars = pd.DataFrame(columns=['Open'])
+            elif isinstance(stock_data.columns, pd.MultiIndex):
+                bars = stock_data[ticker].dropna(how='all')
+            else:
+                bars = stock_data.dropna(how='all')
+            bars = bars.sort_index()
+            self._bars[(symbol, day)] = bars
+
+            if self.bar_cache is not None and not bars.empty:
+                self.bar_cache.put(symbol, day, bars)
+
+    def get_price(self, symbol, target_datetime):
+        day = target_datetime.date()
+        if not self._load_cached(symbol, target_datetime):
+            self.prefetch([symbol], target_datetime)
+
+        bars = self._bars[(symbol, day)]
+        if bars.empty:
+            return f"No data found for {symbol} on {target_datetime}"
+
+        return find_bar_price(bars, symbol, target_datetime, self.max_iterations)
+
+
+class LocalPriceProvider(PriceProvider):
+    """
+    Serves prices from a local CSV or Parquet file of 1-minute bars with 'symbol', 'datetime'
+    and 'Open' columns, a stand-in for Yahoo Finance in tests and replays.
+    """
+
+    def __init__(self, file_path, max_iterations = 10):
+        if file_path.endswith('.parquet'):
+            bars = pd.read_parquet(file_path)
+        else:
+            bars = pd.read_csv(file_path, parse_dates=['datetime'])
+        self.max_iterations = max_iterations
+        self._bars = {symbol: group.set_index('datetime').sort_index() for symbol, group in bars.groupby('symbol')}
+
+    def get_price(self, symbol, target_datetime):
+        if symbol not in self._bars:
+            return f"No data found for {symbol} on {target_datetime}"
+
+        return find_bar_price(self._bars[symbol], symbol, target_datetime, self.max_iterations)
+
+
+def get_price_provider():
+    """
+    Returns the price provider of the run: the local bar file in PRICE_PROVIDER_FILE when set,
+    else Yahoo Finance backed by the on-disk intraday bar cache.
+    """
+    price_file = get_env('PRICE_PROVIDER_FILE')
+    if price_file:
+        return LocalPriceProvider(price_file)
+    return YahooBatchPriceProvider(bar_cache=IntradayBarCache())
 
 # def get_stock_price(df, symbol):
 #     # print(df.loc[df['stocks'] == symbol, 'entry_price'].iloc[0])
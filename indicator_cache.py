@@ -0,0 +1,146 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from settings import get_env
+
+
+def data_fingerprint(*frames):
+    '''
+    Content hash of one or more price/volume frames: their columns, dates and values.
+    Any rewrite of the underlying data (corporate action adjustment, name change merge,
+    new rows) gives a new fingerprint.
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    for frame in frames:
+        stocks = [col for col in frame.columns if col != 'Date']
+        digest.update(repr(stocks).encode())
+        digest.update(pd.to_datetime(frame['Date']).to_numpy(dtype='datetime64[ns]').tobytes())
+        digest.update(np.ascontiguousarray(frame[stocks].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def get_indicator_cache_dir():
+    return get_env('INDICATOR_CACHE_DIR', 'indicator_cache')
+
+
+def clear_disk_indicator_cache(cache_dir=None):
+    '''
+    Removes every cached indicator file. Called after the price/volume files are rewritten,
+    since no entry keyed on the old data can be hit again.
+    '''
+    cache_dir = cache_dir or get_indicator_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return True
+
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.npz'):
+            os.remove(os.path.join(cache_dir, file_name))
+    return True
+
+
+class DiskIndicatorCache:
+    '''
+    On-disk cache of indicator frames, one .npz file per result, keyed by the fingerprint of
+    the price/volume data and the indicator parameters.
+
+    Once the files grow past 'max_bytes' the least recently used ones are evicted.
+    '''
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or get_indicator_cache_dir()
+        self.max_bytes = max_bytes or int(get_env('INDICATOR_CACHE_MAX_BYTES', 2 * 1024**3))
+
+    def _path(self, name, fingerprint, params):
+        key = repr((name, fingerprint, tuple(sorted(params.items()))))
+        return os.path.join(self.cache_dir, f'{name}_{hashlib.sha1(key.encode()).hexdigest()}.npz')
+
+    def get(self, name, fingerprint, params):
+        path = self._path(name, fingerprint, params)
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path, allow_pickle=False) as stored:
+            df = pd.DataFrame(stored['values'], columns=stored['columns'].tolist())
+            df.insert(0, 'Date', stored['dates'])
+
+        # Mark as recently used for eviction
+        os.utime(path)
+        return df
+
+    def put(self, name, fingerprint, params, df):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(name, fingerprint, params)
+        stocks = [col for col in df.columns if col != 'Date']
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as cache_file:
+            np.savez(cache_file,
+                     dates=pd.to_datetime(df['Date']).to_numpy(dtype='datetime64[ns]'),
+                     columns=np.array(stocks, dtype=str),
+                     values=df[stocks].to_numpy())
+        os.replace(tmp_path, path)
+
+        self.evict()
+        return True
+
+    def evict(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.npz')]
+        files.sort(key=os.path.getmtime, reverse=True)
+
+        total_bytes = 0
+        for path in files:
+            total_bytes += os.path.getsize(path)
+            if total_bytes > self.max_bytes:
+                os.remove(path)
+
+
+class IndicatorCache:
+    '''
+    In-process cache of indicator results, shared by every strategy run against the same data.
+
+    Results are keyed by (indicator name, index, as-of date, parameters), so V1-V4 running on
+    the same index and date compute the 200 EMA, TTM and daily changes only once. With a
+    'disk_cache', frames are also looked up on and written to disk by data fingerprint, so a
+    dry run, the real run and the separate strategy scripts reuse each other's results.
+    '''
+
+    def __init__(self, disk_cache=None):
+        self._results = {}
+        self.disk_cache = disk_cache
+
+    @staticmethod
+    def make_key(name, index, as_of, params):
+        return (name, index, pd.Timestamp(as_of), tuple(sorted(params.items())))
+
+    def get_or_compute(self, name, index, as_of, params, compute, fingerprint=None):
+        '''
+        Returns the cached result for the key, calling 'compute()' to build it on a miss.
+
+        Parameters:
+        - name: Indicator name, e.g. 'ema' or 'ttm'.
+        - index: Index the data was filtered on, e.g. 'NIFTY_50'.
+        - as_of: Last date of the data the indicator is computed on.
+        - params: Dict of the parameters that change the result.
+        - compute: Zero argument callable computing the indicator.
+        - fingerprint: data_fingerprint of the input data, enables the disk cache lookup.
+        '''
+        key = self.make_key(name, index, as_of, params)
+        if key in self._results:
+            return self._results[key]
+
+        use_disk = self.disk_cache is not None and fingerprint is not None
+        result = self.disk_cache.get(name, fingerprint, params) if use_disk else None
+
+        if result is None:
+            result = compute()
+            if use_disk and isinstance(result, pd.DataFrame):
+                self.disk_cache.put(name, fingerprint, params, result)
+
+        self._results[key] = result
+        return result
+
+    def clear(self):
+        self._results.clear()
@@ -1,208 +1,351 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import json
-import pprint
 import calendar
-import openpyxl
-from openpyxl import load_workbook
 
-from utils import *
+from utils import forward_fill_array
 
-def calculate_ema(data: pd.DataFrame, dates: pd.Series , timeframe=200):
+def calculate_ema(data: pd.DataFrame, dates: pd.Series , timeframe=200, ema_state=None, as_of=None, prices=None):
     '''
     This function is used to calculate ema.
 
-    Calculates 200EMA by default.
+    Calculates 200EMA by default. The EMA is seeded with the simple average of the
+    first 'timeframe' dates and then rolled forward one date at a time over the whole
+    price matrix, so every stock is updated in the same NumPy operation.
+
+    When 'ema_state' (see ema_state.load_ema_state) is given, stocks with a saved EMA
+    dated on or before 'as_of' resume from that date instead of from the seed window.
+    Stocks without a usable saved value (new listings, invalidated history, state saved
+    by a run on later data) are computed from the seed. Each stock is rolled from its own
+    start row only, so resumed stocks process just the new rows even when others are
+    seeded. The returned frame starts at
+    the latest resume date, so every stock has a value on every returned row and the
+    'as_of' row is always present. 'ema_state' is updated in place to the last date.
 
     Paramters:
     1. 'data' is a pandas dataframe of stocks with date column.
     2. 'dates' is a pandas series of all the dates.
-    3. 'alpha' is float type.
-    4. 'timeframe' is the number of days.
+    3. 'timeframe' is the number of days.
+    4. 'ema_state' is an optional dict of {stock: {'ema': float, 'date': Timestamp}}.
+    5. 'as_of' is the date the EMA is read at (the rollover date), the last date when None.
+    6. 'prices' is an optional float64 matrix of the stock columns of 'data' (same rows and
+       column order), e.g. a read-only memory map, used instead of copying it out of 'data'.
     '''
     alpha = 2/(timeframe + 1)
-    ema = pd.DataFrame(columns=data.columns)
-    initial_ema = data[data['Date'].isin(dates[:timeframe])].mean().to_dict()
-    initial_ema['Date'] = dates[timeframe-1]
-    initial_ema = [initial_ema]
+    stocks = [col for col in data.columns if col != 'Date']
+    if prices is None:
+        prices = data[stocks].to_numpy(dtype=np.float64)
+
+    start_rows = np.full(len(stocks), timeframe - 1)
+    start_values = np.full(len(stocks), np.nan, dtype=np.float64)
+
+    if ema_state:
+        date_rows = {date: row for row, date in enumerate(dates)}
+        as_of_row = len(dates) - 1 if as_of is None else date_rows.get(pd.Timestamp(as_of), -1)
+        for i, stock in enumerate(stocks):
+            saved = ema_state.get(stock)
+            row = date_rows.get(saved['date'], -1) if saved is not None else -1
+            if timeframe - 1 <= row <= as_of_row:
+                start_rows[i] = row
+                start_values[i] = saved['ema']
+
+    # Only the stocks without a resumable state are seeded
+    seeded = np.flatnonzero(start_rows == timeframe - 1)
+    if len(seeded) > 0:
+        seed_stocks = [stocks[i] for i in seeded]
+        start_values[seeded] = data.loc[data['Date'].isin(dates[:timeframe]), seed_stocks].mean().to_numpy(dtype=np.float64)
+
+    # Each stock is rolled from its own start row: the active stocks are a prefix of 'order'
+    # (stocks by start row) that grows as the rows pass start rows
+    order = np.argsort(start_rows, kind='stable')
+    sorted_start_rows = start_rows[order]
+    first_row = sorted_start_rows[0]
+    last_start_row = sorted_start_rows[-1]
+
+    current = np.full(len(stocks), np.nan, dtype=np.float64)
+    ema_values = np.empty((len(dates) - last_start_row, len(stocks)), dtype=np.float64)
+    active = 0
+    for row in range(first_row, len(dates)):
+        if active == len(stocks):
+            current = (prices[row] * alpha) + (current * (1 - alpha))
+        elif active > 0:
+            columns = order[:active]
+            current[columns] = (prices[row, columns] * alpha) + (current[columns] * (1 - alpha))
+
+        starting = np.searchsorted(sorted_start_rows, row, side='right')
+        if starting > active:
+            current[order[active:starting]] = start_values[order[active:starting]]
+            active = starting
+
+        if row >= last_start_row:
+            ema_values[row - last_start_row] = current
+
+    if ema_state is not None:
+        last_date = dates.iloc[-1]
+        for i, stock in enumerate(stocks):
+            ema_state[stock] = {'ema': ema_values[-1, i], 'date': last_date}
+
+    df = pd.DataFrame(ema_values, columns=stocks)
+    df.insert(0, 'Date', dates.iloc[last_start_row:].to_numpy())
+
+    return df[list(data.columns)]
+
+
+def build_month_index(data: pd.DataFrame, dates: pd.Series):
+    '''
+    This function builds the month-boundary index of the price data.
 
-    stocks = list(filter(lambda x: x not in ['Date'], list((data.columns))))
-    
-    for i, date in enumerate(dates[timeframe:], start=timeframe):
-        date_dict = {}
-        date_dict['Date'] = date
-        for stock in stocks:
-            closing_price = data.loc[i, stock]
-            previous_ema = initial_ema[i-timeframe][stock]
-            current_ema = (closing_price * alpha) + (previous_ema * (1 - alpha))
-            date_dict[stock] = current_ema
-        initial_ema.append(date_dict)
-    
-    df = pd.DataFrame(initial_ema)
+    For every calendar month present in 'dates' it holds the position of the first and the
+    last trading row of that month in 'data'. Build it once and pass it to calculate_ttm /
+    calculate_ttm_range to avoid scanning the 'Date' column for every month.
+
+    Paramters:
+    1. 'data' is a pandas dataframe of stocks with date column.
+    2. 'dates' is a pandas series of all the dates.
+
+    Returns a DataFrame with 'period' (year * 12 + month - 1), 'first_row' and 'last_row',
+    sorted by period.
+    '''
+    date_values = pd.to_datetime(data['Date']).to_numpy()
+    rows = np.flatnonzero(np.isin(date_values, pd.to_datetime(dates).to_numpy()))
+
+    order = np.argsort(date_values[rows], kind='stable')
+    rows = rows[order]
+    sorted_dates = date_values[rows]
+
+    periods = pd.DatetimeIndex(sorted_dates).year * 12 + pd.DatetimeIndex(sorted_dates).month - 1
+    unique_periods, first_positions = np.unique(periods, return_index=True)
+    last_positions = np.append(first_positions[1:], len(rows)) - 1
+    # On duplicate dates the first matching row wins, like a 'data['Date'] == date' lookup.
+    last_positions = np.searchsorted(sorted_dates, sorted_dates[last_positions], side='left')
+
+    return pd.DataFrame({'period': unique_periods,
+                         'first_row': rows[first_positions],
+                         'last_row': rows[last_positions]})
+
+
+def _ttm_returns(prices, month_index, periods, lookback_months):
+    index_periods = month_index['period'].to_numpy()
+    window_start = np.searchsorted(index_periods, periods - lookback_months, side='left')
+    window_end = np.searchsorted(index_periods, periods - 1, side='right') - 1
+    has_window = window_start <= window_end
+
+    first_rows = month_index['first_row'].to_numpy()[window_start[has_window]]
+    last_rows = month_index['last_row'].to_numpy()[window_end[has_window]]
+
+    opening_prices = prices[first_rows]
+    closing_prices = prices[last_rows]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        perc_change = np.round(((closing_prices / opening_prices) - 1)*100, 2)
+
+    invalid = np.isnan(opening_prices) | np.isnan(closing_prices) | (opening_prices == 0) | (closing_prices == 0)
+    perc_change[invalid] = 0
 
-    return df
+    return has_window, perc_change
 
 
-def calculate_ttm(data: pd.DataFrame, dates: pd.Series, year = 2010, month = 1, lookback_months = 12):
+def calculate_ttm(data: pd.DataFrame, dates: pd.Series, year = 2010, month = 1, lookback_months = 12, month_index = None):
     '''
     This function used to calculate ttm returns.
 
+    The return of a stock is measured from the first to the last trading date of the
+    'lookback_months' calendar months before the given month. A zero or missing price
+    at either end gives a return of 0.
+
     Paramters:
     1. 'data' is a pandas dataframe of stocks with date column.
     2. 'dates' is a pandas series of all the dates.
-    3. 'start_year' is the year start year for ttm calculations.
+    3. 'year' and 'month' are the month the ttm is calculated for.
+    4. 'lookback_months' is the length of the lookback window.
+    5. 'month_index' is an optional prebuilt build_month_index(data, dates).
 
     '''
-    dates_sorted = dates.sort_values(ascending=True)
-    # print('end_year: ',end_year)
-    # print('end_month: ',end_month)
-    ttm_return = []
+    if month_index is None:
+        month_index = build_month_index(data, dates)
 
-    row_item = {}
-    start_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(months=lookback_months)
-    end_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(days=1)
-    
-    filtered_dates = dates_sorted[(dates_sorted >= start_date) & (dates_sorted <= end_date)]
-    if filtered_dates.empty:
+    stocks = [col for col in data.columns if col != 'Date']
+    prices = data[stocks].to_numpy(dtype=np.float64)
+
+    has_window, perc_change = _ttm_returns(prices, month_index, np.array([year*12 + month - 1]), lookback_months)
+    if not has_window[0]:
         return Exception(f'No dates for TTM. Year: {year}, Month: {month}')
 
-    first_trading_date = filtered_dates.iloc[0]
-    last_trading_date = filtered_dates.iloc[-1]
-    
-    # print('year: ',year)
-    # print('month: ',month)
-    # print('start_date: ', start_date)
-    # print('end_date: ',end_date)
-    # print('first_trading_date: ',first_trading_date)
-    # print('last_trading_date: ',last_trading_date)
-
-    row_item['Date'] = datetime(year=year, month=month, day=1)
-    for stock in data.columns[1:]:
-        try:
-            opening_price = data.loc[data['Date'] == first_trading_date, stock].values[0]
-            closing_price = data.loc[data['Date'] == last_trading_date, stock].values[0]
-            
-            if pd.isna(opening_price) or pd.isna(closing_price) or opening_price == 0 or closing_price == 0:
-                perc_change = 0
-            else:
-                perc_change = round(((closing_price / opening_price) - 1)*100,2)
-
-        except IndexError:
-            perc_change = 0
-            pass
-        except Exception as e:
-            print("stock name: ",stock)
-            print("first_trading_date: ",first_trading_date)
-            print("last_trading_date: ",last_trading_date)
-            print('open_price: ',opening_price)
-            print('closing_price: ',closing_price)
-            raise Exception(e)
-        
-        row_item[stock] = perc_change
-    ttm_return.append(row_item)
-    
-    ttm_return_df = pd.DataFrame(ttm_return)
+    ttm_return_df = pd.DataFrame(perc_change, columns=stocks)
+    ttm_return_df.insert(0, 'Date', [datetime(year=year, month=month, day=1)])
+    return ttm_return_df
+
+
+def calculate_ttm_range(data: pd.DataFrame, dates: pd.Series, start_year = 2010, start_month = 1, 
+                        end_year = 2024, end_month = 3, lookback_months = 12, month_index = None, prices = None):
+    '''
+    This function calculates ttm returns of every stock for every month in a range at once.
+
+    Same return definition as calculate_ttm. Months without any trading date in their
+    lookback window are left out.
+
+    Paramters:
+    1. 'data' is a pandas dataframe of stocks with date column.
+    2. 'dates' is a pandas series of all the dates.
+    3. 'start_year', 'start_month', 'end_year' and 'end_month' bound the months, both inclusive.
+    4. 'lookback_months' is the length of the lookback window.
+    5. 'month_index' is an optional prebuilt build_month_index(data, dates).
+    6. 'prices' is an optional float64 matrix of the stock columns of 'data', see calculate_ema.
+
+    Returns a DataFrame with one row per month, 'Date' being the first day of the month.
+    '''
+    if month_index is None:
+        month_index = build_month_index(data, dates)
+
+    stocks = [col for col in data.columns if col != 'Date']
+    if prices is None:
+        prices = data[stocks].to_numpy(dtype=np.float64)
+
+    periods = np.arange(start_year*12 + start_month - 1, end_year*12 + end_month)
+    has_window, perc_change = _ttm_returns(prices, month_index, periods, lookback_months)
+
+    periods = periods[has_window]
+    ttm_return_df = pd.DataFrame(perc_change, columns=stocks)
+    ttm_return_df.insert(0, 'Date', [datetime(year=p // 12, month=p % 12 + 1, day=1) for p in periods])
     return ttm_return_df
 
 
-def calculate_daily_change(data, dates):
-    # Convert 'Date' column and 'dates' to datetime if they are not already
-    data['Date'] = pd.to_datetime(data['Date'])
+def calculate_daily_change(data, dates, dtype=np.float64, prices=None):
+    '''
+    This function calculates the daily percentage change of every stock over the whole
+    price matrix at once, and keeps the rows of the given dates.
+
+    Missing prices are forward filled before the change is taken, and changes that cannot
+    be computed are set to 0.
+
+    Paramters:
+    1. 'data' is a pandas dataframe of stocks with date column. It is sorted by date in place if it is not already.
+    2. 'dates' is a pandas series of the dates to keep.
+    3. 'dtype' is the output dtype, np.float32 halves the memory of the result.
+    4. 'prices' is an optional float64 matrix of the stock columns of 'data', see calculate_ema.
+       Ignored when 'data' has to be sorted.
+    '''
+    if not pd.api.types.is_datetime64_any_dtype(data['Date']):
+        data['Date'] = pd.to_datetime(data['Date'])
     dates = pd.to_datetime(dates)
-    
-    # Ensure data is sorted by date
-    data = data.sort_values(by='Date')
-    
-    # List to store daily change results
-    daily_changes = []
-    
-    for stock in data.columns[1:]:  # Assuming the first column is 'Date', rest are stock prices
-        stock_data = data[['Date', stock]].set_index('Date')
-        stock_data['Daily Change'] = stock_data[stock].pct_change() * 100  # Percentage change
-        
-        # Filter the data to include only the specified dates
-        stock_data_filtered = stock_data[stock_data.index.isin(dates)]
-        daily_changes.append(stock_data_filtered[['Daily Change']])
-    
-    result = pd.concat(daily_changes, axis=1)
-    result.columns = [f'{col}' for col in data.columns[1:]]
-    result.reset_index(inplace=True)
-    result.fillna(0, inplace=True)
+
+    if not data['Date'].is_monotonic_increasing:
+        data.sort_values(by='Date', inplace=True)
+        prices = None
+
+    stocks = [col for col in data.columns if col != 'Date']
+    if prices is None:
+        prices = data[stocks].to_numpy(dtype=np.float64)
+    prices = forward_fill_array(prices)
+
+    daily_change = np.full_like(prices, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_change[1:] = ((prices[1:] / prices[:-1]) - 1) * 100  # Percentage change
+
+    # Filter the data to include only the specified dates
+    keep = data['Date'].isin(dates).to_numpy()
+    daily_change = daily_change[keep].astype(dtype, copy=False)
+    daily_change[np.isnan(daily_change)] = 0
+
+    result = pd.DataFrame(daily_change, columns=stocks)
+    result.insert(0, 'Date', data['Date'].to_numpy()[keep])
     return result
 
 
-def calculate_coefficient_of_variation(ttm, daily_change, lookback_months=12, absolute = False):
-    
-    ttm['Date'] = pd.to_datetime(ttm['Date'])
-    daily_change['Date'] = pd.to_datetime(daily_change['Date'])
+def _window_std_and_mean(ttm, daily_change, stocks, lookback_months, absolute):
+    '''
+    Standard deviation and mean of every stock's daily changes over the lookback window of
+    every month in 'ttm', from prefix sums of x and x squared over the daily change matrix.
 
-    c_scores = []
+    With 'absolute' only the negative changes are used, as absolute values. Windows holding
+    an infinite change get a NaN std, like pandas would.
+    '''
+    if not daily_change['Date'].is_monotonic_increasing:
+        daily_change = daily_change.sort_values(by='Date')
+
+    values = daily_change[stocks].to_numpy(dtype=np.float64)
+    if absolute:
+        included = values < 0
+        values = -values
+    else:
+        included = ~np.isnan(values)
+    infinite = included & np.isinf(values)
+    values = np.where(included & ~infinite, values, 0.0)
+
+    def prefix_sum(x):
+        return np.vstack([np.zeros((1, x.shape[1])), np.cumsum(x, axis=0)])
+
+    count = prefix_sum(included.astype(np.float64))
+    infinite_count = prefix_sum(infinite.astype(np.float64))
+    total = prefix_sum(values)
+    squares = prefix_sum(values * values)
+
+    month_start = ttm['Date'].dt.to_period('M').dt.start_time
+    start_dates = (month_start - pd.DateOffset(months=lookback_months)).to_numpy()
+    end_dates = (month_start - pd.DateOffset(days=1)).to_numpy()
 
-    for date in ttm['Date']:
-        row_item = {'Date': date}
-        year, month = date.year, date.month
+    change_dates = daily_change['Date'].to_numpy()
+    lo = np.searchsorted(change_dates, start_dates, side='left')
+    hi = np.searchsorted(change_dates, end_dates, side='right')
 
-        start_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(months=lookback_months)
-        end_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(days=1)
+    n = count[hi] - count[lo]
+    window_sum = total[hi] - total[lo]
+    window_squares = squares[hi] - squares[lo]
 
-        # Calculate c-score for each stock
-        for stock in ttm.columns[1:]:
-            if absolute:
-                std_values = daily_change.loc[(daily_change['Date'] >= start_date) & (daily_change['Date'] <= end_date) & (daily_change[stock] < 0), stock].abs()
-            else:
-                std_values = daily_change.loc[(daily_change['Date'] >= start_date) & (daily_change['Date'] <= end_date), stock]
-            
-            std = std_values.std()
-            mean = std_values.mean()
-            
-            if std == 0 or std == np.nan or mean == 0 or mean == np.nan:
-                c_score = None
-            else:
-                try:
-                    variation_ratio = std / mean
-                    c_score = ttm.loc[ttm['Date'] == date, stock].values[0]/ variation_ratio
-                except Exception as e:
-                    c_score = None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = window_sum / n
+        variance = np.maximum(window_squares - window_sum * mean, 0) / (n - 1)
+        std = np.where(n > 1, np.sqrt(variance), np.nan)
 
-            row_item[stock] = c_score
+    has_infinite = (infinite_count[hi] - infinite_count[lo]) > 0
+    std[has_infinite] = np.nan
+    mean[has_infinite] = np.inf
 
-        c_scores.append(row_item)
+    return std, mean
 
-    return pd.DataFrame(c_scores)
+
+def calculate_coefficient_of_variation(ttm, daily_change, lookback_months=12, absolute = False):
+    '''
+    This function calculates the c_score, ttm return divided by the coefficient of variation
+    (std / mean) of the daily changes over the lookback window, for every stock and every month in 'ttm'.
+
+    A stock with a zero std or mean gets no score (NaN).
+    '''
+    ttm['Date'] = pd.to_datetime(ttm['Date'])
+    daily_change['Date'] = pd.to_datetime(daily_change['Date'])
+
+    stocks = list(ttm.columns[1:])
+    std, mean = _window_std_and_mean(ttm, daily_change, stocks, lookback_months, absolute)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c_scores = ttm[stocks].to_numpy(dtype=np.float64) / (std / mean)
+    c_scores[(std == 0) | (mean == 0)] = np.nan
+
+    c_scores_df = pd.DataFrame(c_scores, columns=stocks)
+    c_scores_df.insert(0, 'Date', ttm['Date'].to_numpy())
+    return c_scores_df
 
 
 def calculate_m_score(ttm, daily_change, lookback_months=12, absolute = False):
+    '''
+    This function calculates the m_score, ttm return divided by the std of the daily changes
+    over the lookback window, for every stock and every month in 'ttm'.
 
+    A stock with a zero or undefined std gets a score of 0.
+    '''
     ttm['Date'] = pd.to_datetime(ttm['Date'])
     daily_change['Date'] = pd.to_datetime(daily_change['Date'])
 
-    m_scores = []
-
-    for date in ttm['Date']:
-        row_item = {'Date': date}
-        year, month = date.year, date.month
-        start_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(months=lookback_months)
-        end_date = pd.Timestamp(year=year, month=month, day=1) - pd.DateOffset(days=1)
-       
-        for stock in ttm.columns[1:]:
-            if absolute:
-                std_values = daily_change.loc[(daily_change['Date'] >= start_date) & (daily_change['Date'] <= end_date) & (daily_change[stock] < 0), stock].abs()
-            else:
-                std_values = daily_change.loc[(daily_change['Date'] >= start_date) & (daily_change['Date'] <= end_date), stock]
-            
-            std = std_values.std()
-
-            if std == 0 or pd.isna(std):
-                m_score = 0  # Handle division by zero
-            else:
-                m_score = ttm.loc[ttm['Date'] == date, stock].values[0] / std
-           
-            row_item[stock] = m_score
-
-        m_scores.append(row_item)
-
-    return pd.DataFrame(m_scores)
+    stocks = list(ttm.columns[1:])
+    std, _ = _window_std_and_mean(ttm, daily_change, stocks, lookback_months, absolute)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m_scores = ttm[stocks].to_numpy(dtype=np.float64) / std
+    m_scores[(std == 0) | np.isnan(std)] = 0
+
+    m_scores_df = pd.DataFrame(m_scores, columns=stocks)
+    m_scores_df.insert(0, 'Date', ttm['Date'].to_numpy())
+    return m_scores_df
 
 
 def price_above_ema(data, volumes, ema_list, stock, roll_over_trading_date):
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import traceback
+
+from monthly_portfolio_builder import get_month_portfolio
+from indicator_cache import IndicatorCache, DiskIndicatorCache
+from utils import is_first_trading_day_of_month, TOP_N_STOCKS, STRATEGY_PARAMETERS, load_data_for_indices, get_filtered_data_based_on_index
+from repository import get_repository
+from monthly_orders import create_orders
+from settings import load_env, get_index_list
+
+STRATEGIES = ['V1', 'V2', 'V3', 'V4']
+
+
+def create_portfolios():
+    '''
+    Builds this month's portfolio of every strategy for every index in one process.
+
+    Price and volume data are loaded once for all indices (the union of their constituents, or
+    the whole store when 'NSE' is listed), and the indicators shared by the strategies (200 EMA, TTM, daily changes) are
+    computed once per index through an IndicatorCache, backed by the on-disk cache so a re-run
+    on the same data recomputes nothing.
+    '''
+    try:
+        today = datetime.now()
+        if is_first_trading_day_of_month(today):
+            year = today.year
+            month = today.month
+
+            last_portfolio_year = year - 1 if month == 1 else year
+            last_portfolio_month = 12 if month == 1 else month - 1
+
+            indicator_cache = IndicatorCache(disk_cache=DiskIndicatorCache())
+
+            index_list = get_index_list()
+            data, volumes, constituents = load_data_for_indices(index_list)
+
+            for index in index_list:
+                if index not in constituents:
+                    continue
+
+                filtered_data = get_filtered_data_based_on_index(data=data, index=index, constituents=constituents[index])
+                filtered_volumes = get_filtered_data_based_on_index(data=volumes, index=index, constituents=constituents[index])
+
+                for strategy in STRATEGIES:
+                    db_collection_name = f'{strategy}_{index}'
+
+                    last_month_df = get_repository().fetch_portfolio(collection_name=db_collection_name, 
+                                                    year= last_portfolio_year,
+                                                    month= last_portfolio_month)
+
+                    this_month_portfolio = get_month_portfolio(data= filtered_data,
+                                                               volumes= filtered_volumes,
+                                                               stock_num= TOP_N_STOCKS[index],
+                                                               lookback_months= 12, 
+                                                               sorting_criteria= STRATEGY_PARAMETERS[strategy]['sorting_criteria'],
+                                                               absolute= STRATEGY_PARAMETERS[strategy]['absolute'],
+                                                               price_tracking_enabled= False,
+                                                               stop_loss= 0,
+                                                               last_month_df= last_month_df,
+                                                               year= year,
+                                                               month= month,
+                                                               db_collection_name = db_collection_name,
+                                                               indicator_cache= indicator_cache,
+                                                               index= index,
+                                                               filters= STRATEGY_PARAMETERS[strategy]['filters']
+                                                               )
+
+                    acknowledged = get_repository().save_portfolio(collection_name=db_collection_name,
+                                                  portfolio= this_month_portfolio)
+
+                    if not acknowledged:
+                        raise Exception(f'Error storing month portfolio, year: {year}, month: {month}, index: {index}, strategy: {strategy}')
+
+                    create_orders(strategy_version=strategy, index = index, collection_name = db_collection_name, month_portfolio=this_month_portfolio)
+
+            return True
+
+        else:
+            print('in valid date')
+    except Exception as e:
+        traceback.print_exc()
+        print('error: ', str(e))
+
+
+if __name__ == '__main__':
+    load_env()
+    create_portfolios()
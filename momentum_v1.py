@@ -1,21 +1,13 @@
-from dotenv import find_dotenv, load_dotenv
-import os
 from datetime import datetime, timedelta
 import traceback
 
 from monthly_portfolio_builder import get_month_portfolio
-from utils import is_first_trading_day_of_month, TOP_N_STOCKS, load_and_set_data, get_filtered_data_based_on_index
+from indicator_cache import IndicatorCache, DiskIndicatorCache
+from utils import is_first_trading_day_of_month, TOP_N_STOCKS, STRATEGY_PARAMETERS, load_data_for_indices, get_filtered_data_based_on_index
 from queries import fetch_portfolio, save_portfolio
 from monthly_orders import create_orders
+from settings import load_env, get_index_list
 
-dotenv_path = find_dotenv()
-
-if dotenv_path:
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-else:
-    print("No .env file found")
-
-INDEX_LIST = os.getenv('INDEX_LIST').split(',')
 STRATEGY = 'V1'
 
 
@@ -31,14 +23,19 @@ def create_portfolio():
             last_portfolio_month = 12 if month == 1 else month - 1
 
             # print(year, month, last_portfolio_year, last_portfolio_month, INDEX_LIST)
-            
-            data = load_and_set_data(file_path=f"NSE_PRICE_DATA.csv", data_type='PRICE')
-            volumes = load_and_set_data(file_path=f"NSE_VOLUME_DATA.csv", data_type='VOLUME')
 
-            for index in INDEX_LIST:
+            indicator_cache = IndicatorCache(disk_cache=DiskIndicatorCache())
+
+            index_list = get_index_list()
+            data, volumes, constituents = load_data_for_indices(index_list)
+
+            for index in index_list:
+                if index not in constituents:
+                    continue
+
                 db_collection_name = f'{STRATEGY}_{index}'
-                filtered_data = get_filtered_data_based_on_index(data=data, index=index)
-                filtered_volumes = get_filtered_data_based_on_index(data=volumes, index=index)
+                filtered_data = get_filtered_data_based_on_index(data=data, index=index, constituents=constituents[index])
+                filtered_volumes = get_filtered_data_based_on_index(data=volumes, index=index, constituents=constituents[index])
 
                 last_month_df = fetch_portfolio(collection_name=db_collection_name, 
                                                 year= last_portfolio_year,
@@ -48,14 +45,17 @@ def create_portfolio():
                                                             volumes= filtered_volumes,
                                                             stock_num= TOP_N_STOCKS[index],
                                                             lookback_months= 12, 
-                                                            sorting_criteria= 'ttm',
-                                                            absolute= False,
+                                                            sorting_criteria= STRATEGY_PARAMETERS[STRATEGY]['sorting_criteria'],
+                                                            absolute= STRATEGY_PARAMETERS[STRATEGY]['absolute'],
                                                             price_tracking_enabled= False,
                                                             stop_loss= 0,
                                                             last_month_df= last_month_df,
                                                             year= year,
                                                             month= month,
-                                                            db_collection_name = db_collection_name
+                                                            db_collection_name = db_collection_name,
+                                                            indicator_cache= indicator_cache,
+                                                            index= index,
+                                                            filters= STRATEGY_PARAMETERS[STRATEGY]['filters']
                                                             )
                 
 
@@ -76,4 +76,6 @@ def create_portfolio():
         print('error: ', str(e))
 
 
-create_portfolio()
\ No newline at end of file
+if __name__ == '__main__':
+    load_env()
+    create_portfolio()
@@ -2,10 +2,9 @@ from datetime import datetime
 import uuid
 
 
-from indicators import *
-from utils import *
-from queries import *
-from enums import *
+from utils import get_first_trading_date
+from queries import add_orders_to_ledger
+from enums import OrderType, OrderStatus
 
 
 def create_orders(strategy_version, index, collection_name,  month_portfolio):
@@ -45,14 +44,25 @@ def create_orders(strategy_version, index, collection_name,  month_portfolio):
                            'month': month
                            }
     
+    orders = []
     for order in sell_order:
         order = {**sell_order_metadata, **order}
-        order['order_id'] = str(uuid.uuid4())
-        add_order_to_ledger(order)
+        order['order_id'] = get_order_id(collection_name, date, OrderType.SELL.value, order['stock'])
+        orders.append(order)
 
     for order in buy_order:
         order = {**buy_order_metadata, **order}
-        order['order_id'] = str(uuid.uuid4())
-        add_order_to_ledger(order)
+        order['order_id'] = get_order_id(collection_name, date, OrderType.BUY.value, order['stock'])
+        orders.append(order)
+
+    add_orders_to_ledger(orders)
 
     return True
+
+
+def get_order_id(collection_name, order_placement_date, order_type, stock):
+    '''
+    Deterministic order id, the same for the same order on every retry, so the
+    unique order_id index in the ledger rejects duplicates.
+    '''
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{collection_name}/{order_placement_date.date()}/{order_type}/{stock}"))
@@ -1,7 +1,13 @@
 from functools import partial
+from datetime import datetime
 
-from indicators import *
-from utils import *
+from indicators import (calculate_ema, calculate_ttm, calculate_daily_change, calculate_m_score,
+                        calculate_coefficient_of_variation)
+from eligibility import get_filters
+from utils import (check_dataframes, sort_dates, get_scripts_sorted, update_stock_list, process_monthly_portfolio,
+                   get_trading_dates)
+from ema_state import load_ema_state, save_ema_state
+from indicator_cache import IndicatorCache, data_fingerprint
 
 
 def get_month_portfolio(data, volumes,
@@ -11,25 +17,58 @@ def get_month_portfolio(data, volumes,
                         price_tracking_enabled, stop_loss,
                         last_month_df,
                         year, month, 
-                        db_collection_name):
+                        db_collection_name,
+                        indicator_cache=None, index=None, filters=None):
     
     data, volumes, dates = check_dataframes(prices_df=data, volumes_df=volumes)
     
     dates = sort_dates(dates)
 
-    ema_200 = calculate_ema(data = data, dates=dates,timeframe=200)
+    if indicator_cache is None:
+        indicator_cache = IndicatorCache()
+    elif index is None:
+        # Cache keys are per index, a shared cache without one would mix the indicators of different indices
+        raise ValueError('index is required when an indicator_cache is passed')
+
+    fingerprint = None
+    if indicator_cache.disk_cache is not None:
+        fingerprint = indicator_cache.get_or_compute(name='fingerprint', index=index, as_of=dates.iloc[-1], params={},
+                                                     compute=lambda: data_fingerprint(data, volumes))
+
+    cached = partial(indicator_cache.get_or_compute, index=index, as_of=dates.iloc[-1], fingerprint=fingerprint)
+
+    # The EMA is read at the rollover date, saved state from a later run must not be resumed from
+    roll_over_trading_date = get_trading_dates(dates, year, month)[1]
+
+    ema_200 = cached(name='ema', params={'timeframe': 200, 'as_of': roll_over_trading_date},
+                     compute=lambda: calculate_ema(data = data, dates=dates,timeframe=200,
+                                                   ema_state=load_ema_state(timeframe=200),
+                                                   as_of=roll_over_trading_date))
+
+    # Saved from the frame so a cache hit updates the state file too
+    last_ema_date = ema_200['Date'].iloc[-1]
+    save_ema_state({stock: {'ema': ema_200[stock].iloc[-1], 'date': last_ema_date}
+                    for stock in ema_200.columns if stock != 'Date'}, timeframe=200)
 
     ema = [ema_200]
 
-    sorting_score = calculate_ttm(data, dates, year, month, lookback_months)
+    ttm_params = {'year': year, 'month': month, 'lookback_months': lookback_months}
+    sorting_score = cached(name='ttm', params=ttm_params,
+                           compute=lambda: calculate_ttm(data, dates, year, month, lookback_months))
+
+    if sorting_criteria in ('m_score', 'c_score'):
+        daily_change = cached(name='daily_change', params={},
+                              compute=lambda: calculate_daily_change(data,dates))
 
     if sorting_criteria == 'm_score':
-        daily_change = calculate_daily_change(data,dates)
-        sorting_score = calculate_m_score(sorting_score, daily_change, lookback_months, absolute)
+        ttm = sorting_score
+        sorting_score = cached(name='m_score', params={**ttm_params, 'absolute': absolute},
+                               compute=lambda: calculate_m_score(ttm, daily_change, lookback_months, absolute))
 
     if sorting_criteria == 'c_score':
-        daily_change = calculate_daily_change(data,dates)
-        sorting_score = calculate_coefficient_of_variation(sorting_score, daily_change, lookback_months, absolute)
+        ttm = sorting_score
+        sorting_score = cached(name='c_score', params={**ttm_params, 'absolute': absolute},
+                               compute=lambda: calculate_coefficient_of_variation(ttm, daily_change, lookback_months, absolute))
     
     sort_function = partial(get_scripts_sorted, sorting_score = sorting_score)
 
@@ -42,7 +81,7 @@ def get_month_portfolio(data, volumes,
     month_wise_returns = process_monthly_portfolio(data, volumes, 
                                                    dates, year, month,
                                                    ema, sort_function, stock_num, last_month_df, 
-                                                   (price_above_ema, price_above_52WKH, volume_check), 
+                                                   get_filters(filters), 
                                                    return_calculations)
 
 
@@ -1,31 +1,124 @@
-from dotenv import find_dotenv, load_dotenv
 from datetime import datetime, time
-import threading
+from time import perf_counter
 import math
 
-from indicators import *
-from utils import *
-from queries import *
-from enums import *
-from fetch_prices import *
+import numpy as np
 
-dotenv_path = find_dotenv()
-
-if dotenv_path:
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-else:
-    print("No .env file found")
+from utils import is_first_trading_day_of_month, get_cash_balance
+from queries import (ensure_order_ledger_indexes, get_pending_orders_for_date,
+                     update_cash_component_in_portfolio_document)
+from repository import PortfolioUpdates
+from enums import OrderType, OrderStatus
+from fetch_prices import get_price_provider
+from settings import load_env, get_index_list
 
 STRATEGIES = ['V1', 'V2', 'V3','V4']
-INDEX_LIST = os.getenv('INDEX_LIST').split(',')
 
-def execute_order():
+
+def run_timed(func, *args, **kwargs):
+    '''
+    Runs 'func' and returns (result, seconds, error). Exceptions are caught and returned as
+    'error' so one failed order does not stop the others.
+    '''
+    start = perf_counter()
+    try:
+        return func(*args, **kwargs), perf_counter() - start, None
+    except Exception as e:
+        return None, perf_counter() - start, e
+
+
+def resolve_prices(price_provider, stocks, target_datetime, execution_report):
+    '''
+    Resolves the execution price of every stock once from the price provider.
+
+    Every symbol is prefetched in one batched request (the only fetch concurrency: the Yahoo
+    provider downloads the batch with download_bars(threads=True)) and then looked up locally.
+
+    Returns the shared {stock: price} map used by every strategy. Stocks whose price could not
+    be fetched are left out and recorded as failures in 'execution_report'.
+    '''
+    stocks = sorted(set(stocks))
+    price_provider.prefetch(stocks, target_datetime)
+
+    prices = {}
+    for stock in stocks:
+        price, seconds, error = run_timed(price_provider.get_price, symbol=stock, target_datetime=target_datetime)
+        if error is None and not isinstance(price, (int, float, np.number)):
+            # The provider returns a message instead of a price when no bar is found
+            error = price
+        execution_report.append({'stock': stock, 'stage': 'price', 'seconds': seconds, 'error': error})
+        if error is None:
+            prices[stock] = price
+
+    return prices
+
+
+def place_orders(strategy_name, order_type, orders, portfolio_updates, execution_report):
+    '''
+    Places (stock, order_quantity, order, price) orders one by one. Placing an order only
+    records its changes in 'portfolio_updates', so there is no I/O to run concurrently; a
+    failed order is recorded in 'execution_report' and does not stop the others.
+    '''
+    for stock, order_quantity, order, price in orders:
+        _, seconds, error = run_timed(place_order, strategy_name, stock, order_type, 'at_market',
+                                      order_quantity, order, price, portfolio_updates)
+        execution_report.append({'strategy_name': strategy_name, 'stock': stock, 'order_type': order_type,
+                                 'stage': 'place', 'seconds': seconds, 'error': error})
+
+
+def flush_portfolio_updates(portfolio_updates, strategy_name, order_type, execution_report):
+    '''
+    Writes the ledger and portfolio changes of a strategy's placed orders (one bulk write per
+    document). Returns False, with the failure recorded in 'execution_report', if the write failed.
+    '''
+    _, seconds, error = run_timed(portfolio_updates.flush)
+    execution_report.append({'strategy_name': strategy_name, 'stock': f'{order_type} orders', 'order_type': order_type,
+                             'stage': 'flush', 'seconds': seconds, 'error': error})
+    return error is None
+
+
+def print_execution_report(execution_report):
+    # Placing is in memory only, its items are reported for their failures
+    for stage in ['price', 'flush']:
+        items = [item for item in execution_report if item['stage'] == stage]
+        if len(items) == 0:
+            continue
+        seconds = [item['seconds'] for item in items]
+        print(f'{stage}: {len(items)} calls, avg {sum(seconds)/len(seconds):.2f}s, max {max(seconds):.2f}s')
+
+    for item in execution_report:
+        if item['error'] is not None:
+            print(f"FAILED {item['stage']} for {item['stock']} {item.get('strategy_name', '')}: {item['error']}")
+
+
+def get_all_pending_orders(today):
+    '''
+    Returns the pending {'sell': [...], 'buy': [...]} orders of 'today' for every strategy_name,
+    from one ledger query.
+    '''
+    grouped_orders = get_pending_orders_for_date(today)
+    index_list = get_index_list()
+
+    pending_orders = {}
+    for strategy in STRATEGIES:
+        for index in index_list:
+            strategy_name = f'{strategy}_{index}'
+            pending_orders[strategy_name] = {
+                'sell': grouped_orders.get((strategy_name, OrderType.SELL.value), []),
+                'buy': grouped_orders.get((strategy_name, OrderType.BUY.value), [])
+            }
+    return pending_orders
+
+
+def execute_order(price_provider=None):
     today = datetime(year=2025, month=6, day=2)
     # today = datetime.now() 
 
     if not is_first_trading_day_of_month(today):
         print('Not first trading day')
         return
+
+    ensure_order_ledger_indexes()
     
     year = today.year
     month = today.month
@@ -35,61 +128,98 @@ def execute_order():
 
     order_placement_datetime = datetime.combine(today.date(), time(hour=10, minute=0, second=0))
 
-    # prices_df = pd.read_excel('/Users/shubhgoela/Downloads/stock_carry (1).xlsx', sheet_name='stock_carry')
-    for strategy in STRATEGIES:
-        for index in INDEX_LIST:
-            total_cash = 0
-            cash_utilised = 0
-            strategy_name = f'{strategy}_{index}'
+    execution_report = []
+
+    # Prices of every symbol traded today, across all strategies and indices, in one request
+    pending_orders = get_all_pending_orders(today)
+    stocks = set(order['stock'] for orders in pending_orders.values() for order in orders['sell'] + orders['buy'])
+    price_provider = price_provider or get_price_provider()
 
-            print('strategy_name : ', strategy_name)
-            cash_balance = get_cash_balance(strategy_name,last_portfolio_year, last_portfolio_month)
-            sell_orders = get_pending_orders_by_date(date=today, strategy=strategy_name, order_type= OrderType.SELL.value)
-            buy_orders = get_pending_orders_by_date(date=today, strategy=strategy_name, order_type= OrderType.BUY.value)
-
-            print('sell order len: ', len(sell_orders))
-            print('buy order len: ', len(buy_orders))
-
-            if len(sell_orders) > 0:
-                for order in sell_orders:
-                    stock = order['stock']
-                    price = get_stock_price(symbol=stock, target_datetime=order_placement_datetime)
-                    # price = get_stock_price(prices_df,stock)
-                    order_quantity = order['order_quantity']
-                    total_cash += (round(price,2) * round(order_quantity))
-                    thread = threading.Thread(target=place_order, args=(strategy_name, stock, OrderType.SELL.value, 'at_market', order_quantity, order, price))
-                    thread.start()
-
-            
-            perform_cash_operations(strategy_name, last_portfolio_year, last_portfolio_month, 'recovered_cash', total_cash)
-
-            total_cash = round(total_cash, 2) + cash_balance
-
-            perform_cash_operations(strategy_name, year, month, 'cash', total_cash)
-
-            if len(buy_orders)>0:
-                cash_for_each_script = total_cash/len(buy_orders)
-                for order in buy_orders:
-                    stock = order['stock']
-                    price = get_stock_price(symbol=stock, target_datetime=order_placement_datetime)
-                    # price = get_stock_price(prices_df,stock)
-                    order_quantity = math.floor(cash_for_each_script/price)
-                    cash_utilised += (price*order_quantity)
-                    thread = threading.Thread(target=place_order, args=(strategy_name, stock, OrderType.BUY.value, 'at_market', order_quantity, order, price))
-                    thread.start()
-                
-            cash_balance = total_cash - cash_utilised
-            perform_cash_operations(strategy_name, year, month, 'cash_balance', cash_balance)
-
-
-def place_order(strategy_name, stock, order_type, price_mode, order_quantity, order_metadata, execution_price):
+    # prices_df = pd.read_excel('/Users/shubhgoela/Downloads/stock_carry (1).xlsx', sheet_name='stock_carry')
+    try:
+        # Every strategy holding a stock fills at the same price
+        prices = resolve_prices(price_provider, stocks, order_placement_datetime, execution_report)
+
+        for strategy in STRATEGIES:
+            for index in get_index_list():
+                strategy_name = f'{strategy}_{index}'
+                execute_strategy_orders(strategy_name, pending_orders[strategy_name], prices,
+                                        year, month, last_portfolio_year, last_portfolio_month, execution_report)
+    finally:
+        print_execution_report(execution_report)
+
+
+def execute_strategy_orders(strategy_name, orders, prices,
+                            year, month, last_portfolio_year, last_portfolio_month, execution_report):
+    '''
+    Places a strategy's sell then buy orders and updates its cash.
+
+    The ledger and portfolio changes of each side are written as soon as its orders are placed,
+    before the cash updates depending on them, so a failure never leaves cash updated for
+    orders still pending. If a write fails the strategy's remaining cash updates are skipped.
+    '''
+    total_cash = 0
+    cash_utilised = 0
+    portfolio_updates = PortfolioUpdates()
+
+    print('strategy_name : ', strategy_name)
+    cash_balance = get_cash_balance(strategy_name,last_portfolio_year, last_portfolio_month)
+    sell_orders = orders['sell']
+    buy_orders = orders['buy']
+
+    print('sell order len: ', len(sell_orders))
+    print('buy order len: ', len(buy_orders))
+
+    if len(sell_orders) > 0:
+        placed = []
+        for order in sell_orders:
+            stock = order['stock']
+            if stock not in prices:
+                continue
+            price = prices[stock]
+            order_quantity = order['order_quantity']
+            total_cash += (round(price,2) * round(order_quantity))
+            placed.append((stock, order_quantity, order, price))
+        place_orders(strategy_name, OrderType.SELL.value, placed, portfolio_updates, execution_report)
+
+        if not flush_portfolio_updates(portfolio_updates, strategy_name, OrderType.SELL.value, execution_report):
+            return False
+
+    perform_cash_operations(strategy_name, last_portfolio_year, last_portfolio_month, 'recovered_cash', total_cash)
+
+    total_cash = round(total_cash, 2) + cash_balance
+
+    perform_cash_operations(strategy_name, year, month, 'cash', total_cash)
+
+    if len(buy_orders)>0:
+        cash_for_each_script = total_cash/len(buy_orders)
+        placed = []
+        for order in buy_orders:
+            stock = order['stock']
+            if stock not in prices:
+                continue
+            price = prices[stock]
+            order_quantity = math.floor(cash_for_each_script/price)
+            cash_utilised += (price*order_quantity)
+            placed.append((stock, order_quantity, order, price))
+        place_orders(strategy_name, OrderType.BUY.value, placed, portfolio_updates, execution_report)
+
+        if not flush_portfolio_updates(portfolio_updates, strategy_name, OrderType.BUY.value, execution_report):
+            return False
+
+    cash_balance = total_cash - cash_utilised
+    perform_cash_operations(strategy_name, year, month, 'cash_balance', cash_balance)
+    return True
+
+
+def place_order(strategy_name, stock, order_type, price_mode, order_quantity, order_metadata, execution_price, portfolio_updates):
     print(f'placed order for {stock}, order type: {order_type}, price_mode: {price_mode}, execution_price: {execution_price} quantity: {order_quantity}')
     order_metadata['order_quantity'] = order_quantity
     order_metadata['price_mode'] = price_mode
     order_metadata['execution_price'] = round(execution_price,2)
     order_metadata['order_status'] = OrderStatus.EXECUTED.value
     order_metadata['order_placed_on'] = datetime.now()
-    update_order_in_ledger(order_id=order_metadata['order_id'], to_update=order_metadata)
+    portfolio_updates.update_order(order_id=order_metadata['order_id'], to_update=order_metadata)
     
     price_type = None
     if order_type == OrderType.SELL.value:
@@ -97,21 +227,23 @@ def place_order(strategy_name, stock, order_type, price_mode, order_quantity, or
     else:
         price_type = 'initial_price'
     
-    update_price_in_portfolio(strategy_name=strategy_name,
-                                year=order_metadata['year'],
-                                month=order_metadata['month'],
-                                stock=stock,
-                                price_type=price_type,
-                                price=round(execution_price, 2))
+    portfolio_updates.set_price(strategy_name=strategy_name,
+                                  year=order_metadata['year'],
+                                  month=order_metadata['month'],
+                                  stock=stock,
+                                  price_type=price_type,
+                                  price=round(execution_price, 2))
 
-    update_quantity_in_portfolio(strategy_name=strategy_name,
-                                year=order_metadata['year'],
-                                month=order_metadata['month'],
-                                stock=stock,
-                                quantity=order_quantity)
+    portfolio_updates.set_quantity(strategy_name=strategy_name,
+                                   year=order_metadata['year'],
+                                   month=order_metadata['month'],
+                                   stock=stock,
+                                   quantity=order_quantity)
 
 
 def perform_cash_operations(strategy_name, year, month, type, cash_amount):
     update_cash_component_in_portfolio_document(strategy_name, year, month, type, cash_amount)
 
-execute_order()
\ No newline at end of file
+if __name__ == '__main__':
+    load_env()
+    execute_order()
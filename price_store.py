@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+
+from settings import get_env
+
+
+def get_store_path(file_path):
+    '''
+    Returns the path of the columnar (Feather) store of a wide price/volume CSV,
+    e.g. NSE_PRICE_DATA.csv -> NSE_PRICE_DATA.feather. The store sits next to the CSV
+    unless PRICE_STORE_DIR is set.
+    '''
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    store_dir = get_env('PRICE_STORE_DIR', os.path.dirname(file_path))
+    return os.path.join(store_dir, f'{base_name}.feather')
+
+
+def import_csv_to_store(file_path):
+    '''
+    One time import of a wide price/volume CSV into the columnar store.
+    Unnamed/blank columns are dropped, the 'Date' column is parsed.
+
+    Returns the imported DataFrame.
+    '''
+    data = pd.read_csv(file_path, parse_dates=['Date'])
+    data = data.loc[:, ~(data.columns.str.contains('^Unnamed') | data.columns.isnull())]
+    write_store(data, file_path, export_csv=False)
+    return data
+
+
+def write_store(data, file_path, export_csv=True):
+    '''
+    Writes a price/volume DataFrame to the columnar store of 'file_path'.
+
+    With 'export_csv' the CSV is rewritten first, so tools still reading the CSV see the
+    same data and the store stays the newer of the two files.
+    '''
+    if export_csv:
+        data.to_csv(file_path, index=False)
+
+    store_path = get_store_path(file_path)
+    tmp_path = f'{store_path}.tmp'
+    data.reset_index(drop=True).to_feather(tmp_path)
+    os.replace(tmp_path, store_path)
+    return True
+
+
+def _ensure_store(file_path):
+    '''
+    Returns the store path of 'file_path', (re)importing the CSV first when the store does not
+    exist yet or the CSV was modified after it.
+    '''
+    store_path = get_store_path(file_path)
+    if not os.path.exists(store_path) or (os.path.exists(file_path) and os.path.getmtime(file_path) > os.path.getmtime(store_path)):
+        import_csv_to_store(file_path)
+    return store_path
+
+
+def read_store_columns(file_path):
+    '''
+    Returns the column names of the store of 'file_path', read from the file schema only.
+    '''
+    from pyarrow import ipc
+
+    store_path = _ensure_store(file_path)
+    with ipc.open_file(store_path) as reader:
+        return reader.schema.names
+
+
+def read_store(file_path, columns=None):
+    '''
+    Reads price/volume data from the columnar store of 'file_path'.
+
+    Only the 'Date' column and the requested 'columns' are read from disk. The CSV is
+    (re)imported first when the store does not exist yet or the CSV was modified after it.
+
+    Parameters:
+    - file_path: Path of the CSV the store was imported from, e.g. NSE_PRICE_DATA.csv.
+    - columns: Optional list of stock columns to load, all columns when None.
+    '''
+    store_path = _ensure_store(file_path)
+
+    if columns is not None:
+        columns = ['Date'] + [col for col in columns if col != 'Date']
+
+    return pd.read_feather(store_path, columns=columns)
+
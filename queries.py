@@ -1,50 +1,79 @@
-import os
-from dotenv import find_dotenv, load_dotenv
+import threading
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
 import certifi
 
 from enums import *
-
-dotenv_path = find_dotenv()
-load_dotenv(dotenv_path=dotenv_path, override=True)
-
-DB_URI = os.getenv('DB_URI')
-DB_NAME = os.getenv('DB_NAME')
-
-client = MongoClient(DB_URI, tlsCAFile=certifi.where())
-
-db = client[DB_NAME]
+from settings import get_env
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    '''
+    Returns the process wide MongoClient, created on first use. The client keeps a connection
+    pool shared by every thread, sized and timed out through the environment:
+    DB_MAX_POOL_SIZE, DB_MIN_POOL_SIZE, DB_SERVER_SELECTION_TIMEOUT_MS, DB_CONNECT_TIMEOUT_MS
+    and DB_SOCKET_TIMEOUT_MS.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MongoClient(get_env('DB_URI'), tlsCAFile=certifi.where(),
+                                  maxPoolSize=int(get_env('DB_MAX_POOL_SIZE', 20)),
+                                  minPoolSize=int(get_env('DB_MIN_POOL_SIZE', 0)),
+                                  serverSelectionTimeoutMS=int(get_env('DB_SERVER_SELECTION_TIMEOUT_MS', 10000)),
+                                  connectTimeoutMS=int(get_env('DB_CONNECT_TIMEOUT_MS', 10000)),
+                                  socketTimeoutMS=int(get_env('DB_SOCKET_TIMEOUT_MS', 60000)))
+    return _client
+
+
+def get_db():
+    return get_client()[get_env('DB_NAME')]
+
+
+def close_connection():
+    '''
+    Closes the pooled client. The next query opens a new one.
+    '''
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+    return True
 
 
 def fetch_portfolio(collection_name, year, month):
-    data = db[collection_name].find_one({"year": year, "month": month})
+    data = get_db()[collection_name].find_one({"year": year, "month": month})
     return data
 
 
 def save_portfolio(collection_name, portfolio):
-    data = db[collection_name].insert_one(portfolio)
+    data = get_db()[collection_name].insert_one(portfolio)
     return data.acknowledged
 
 
 def save_all_corp_action(action):
-    data = db['collection_corp_action'].insert_one(action)
+    data = get_db()['collection_corp_action'].insert_one(action)
     return data.acknowledged
 
 
 def save_corp_action(action):
-    data = db['corp_action_adjusted'].insert_one(action)
+    data = get_db()['corp_action_adjusted'].insert_one(action)
     return data.acknowledged
 
 
 def get_index_constituents(index):
-    data = db['collection_index_constituents'].find_one({'index': index})
+    data = get_db()['collection_index_constituents'].find_one({'index': index})
     return data['scrip_list']
 
 
 def update_index_constituents(index, update):
     update['updated_on'] = datetime.now()
-    db['collection_index_constituents'].find_one_and_update(
+    get_db()['collection_index_constituents'].find_one_and_update(
             {"index": index},
             {"$set": update}
         )
@@ -52,20 +81,20 @@ def update_index_constituents(index, update):
 
 
 def get_adjusted_corp_actions(date):
-    data = db['corp_action_adjusted'].find_one({'date': date})
+    data = get_db()['corp_action_adjusted'].find_one({'date': date})
     return data
 
 
 def add_holiday_to_year(date):
     if isinstance(date, list):
-        data = db['collection_holidays'].find_one_and_update({"year": date[0].year},  
+        data = get_db()['collection_holidays'].find_one_and_update({"year": date[0].year},  
                                                              {"$push": {"dates": {"$each": date}},
                                                              "$set": {'updated_on': datetime.now()}},
                                                              upsert=True,
                                                              return_document=True
                                                              )
     else:
-        data = db['collection_holidays'].find_one_and_update({"year": date.year},  
+        data = get_db()['collection_holidays'].find_one_and_update({"year": date.year},  
                                                             {"$push": {"dates": date}, 
                                                             "$set": {'updated_on': datetime.now()}},
                                                             upsert=True,
@@ -75,32 +104,93 @@ def add_holiday_to_year(date):
 
 
 def get_holidays_for_year(year):
-    data = db['collection_holidays'].find_one({'year': year})
+    data = get_db()['collection_holidays'].find_one({'year': year})
     return data
 
 
 def get_mail_template(template_name):
-    data = db['collection_mail_templates'].find_one({'template_name': template_name})
+    data = get_db()['collection_mail_templates'].find_one({'template_name': template_name})
     return data
 
 
 def add_order_to_ledger(order):
-    data = db['collection_orders'].insert_one(order)
+    data = get_db()['collection_orders'].insert_one(order)
     return data.acknowledged
 
 
+_order_ledger_indexes_ensured = False
+
+PENDING_ORDERS_INDEX = [('order_placement_date', ASCENDING), ('strategy_name', ASCENDING), ('order_status', ASCENDING), ('order_type', ASCENDING)]
+
+
+def ensure_order_ledger_indexes():
+    '''
+    Creates the ledger indexes if missing (create_index is a no-op for an existing index) and checks
+    they are in place: unique order_id, and the compound index serving the pending orders lookup.
+    '''
+    global _order_ledger_indexes_ensured
+    if not _order_ledger_indexes_ensured:
+        get_db()['collection_orders'].create_index('order_id', unique=True)
+        get_db()['collection_orders'].create_index(PENDING_ORDERS_INDEX, name='pending_orders_by_date')
+
+        index_keys = [index['key'] for index in get_db()['collection_orders'].index_information().values()]
+        if [tuple(key) for key in PENDING_ORDERS_INDEX] not in [[tuple(key) for key in keys] for keys in index_keys]:
+            raise Exception('Pending orders index missing on collection_orders')
+
+        _order_ledger_indexes_ensured = True
+    return True
+
+
+def add_orders_to_ledger(orders):
+    '''
+    Inserts all orders into the ledger in one unordered insert_many round trip.
+
+    Orders whose order_id is already in the ledger are skipped (unique index on order_id),
+    so retrying a partially written batch is idempotent. Returns the number of inserted orders.
+    '''
+    if len(orders) == 0:
+        return 0
+
+    ensure_order_ledger_indexes()
+    try:
+        data = get_db()['collection_orders'].insert_many(orders, ordered=False)
+        return len(data.inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+
 def get_pending_orders_by_date(date, strategy, order_type = 'ALL'):
 
     filter = {'order_placement_date': date, 'strategy_name': strategy, 'order_status': OrderStatus.PENDING.value}
     if order_type == OrderType.BUY.value or order_type == OrderType.SELL.value:
         filter['order_type'] = order_type
 
-    data = list(db['collection_orders'].find(filter))
+    data = list(get_db()['collection_orders'].find(filter))
+    return data
+
+
+def get_pending_orders_for_date(date):
+    '''
+    All pending orders of a date across every strategy, in one aggregation grouped by
+    strategy_name and order_type.
+
+    Returns a dict of {(strategy_name, order_type): [orders]}.
+    '''
+    pipeline = [
+        {'$match': {'order_placement_date': date, 'order_status': OrderStatus.PENDING.value}},
+        {'$group': {'_id': {'strategy_name': '$strategy_name', 'order_type': '$order_type'}, 'orders': {'$push': '$$ROOT'}}}
+    ]
+
+    data = {}
+    for group in get_db()['collection_orders'].aggregate(pipeline):
+        data[(group['_id']['strategy_name'], group['_id']['order_type'])] = group['orders']
     return data
 
 
 def update_cash_component_in_portfolio_document(strategy_name, year, month, to_update_key, to_update_value):
-    db[strategy_name].find_one_and_update(
+    get_db()[strategy_name].find_one_and_update(
         {'year': year, 'month': month},
         {"$set": {f"df.{to_update_key}": to_update_value}}
     )
@@ -108,12 +198,12 @@ def update_cash_component_in_portfolio_document(strategy_name, year, month, to_u
 
 
 def update_order_in_ledger(order_id, to_update):
-    db['collection_orders'].find_one_and_update({'order_id': order_id}, {'$set': to_update})
+    get_db()['collection_orders'].find_one_and_update({'order_id': order_id}, {'$set': to_update})
     return
 
 
 def update_price_in_portfolio(strategy_name, year, month, stock, price_type, price):
-    db[strategy_name].find_one_and_update(
+    get_db()[strategy_name].find_one_and_update(
     {'year': year, 'month': month}, 
     {"$set": {f"df.portfolio.$[stock].{price_type}": price}}, 
     array_filters=[{"stock.stock": stock}] 
@@ -121,23 +211,48 @@ def update_price_in_portfolio(strategy_name, year, month, stock, price_type, pri
 
 
 def update_quantity_in_portfolio(strategy_name, year, month, stock, quantity):
-    db[strategy_name].find_one_and_update(
+    get_db()[strategy_name].find_one_and_update(
     {'year': year, 'month': month},  # Match the correct document
     {"$set": {f"df.portfolio.$[stock].quantity": quantity}},  # Update final_price for the matched stock
     array_filters=[{"stock.stock": stock}]  # Filter the correct stock in the portfolio array
 )
 
 
+def write_portfolio_updates(portfolio_fields, order_updates):
+    '''
+    Writes the changes collected by a PortfolioUpdates with one bulk_write per (strategy, year,
+    month) portfolio document and one for the ledger.
+
+    Parameters:
+    - portfolio_fields: Dict of {(strategy_name, year, month): {stock: {field: value}}}.
+    - order_updates: Dict of {order_id: {field: value}}.
+    '''
+    for (strategy_name, year, month), stocks in portfolio_fields.items():
+        operations = [
+            UpdateOne({'year': year, 'month': month},
+                      {"$set": {f"df.portfolio.$[stock].{field}": value for field, value in fields.items()}},
+                      array_filters=[{"stock.stock": stock}])
+            for stock, fields in stocks.items()
+        ]
+        get_db()[strategy_name].bulk_write(operations, ordered=False)
+
+    if len(order_updates) > 0:
+        operations = [UpdateOne({'order_id': order_id}, {'$set': to_update}) for order_id, to_update in order_updates.items()]
+        get_db()['collection_orders'].bulk_write(operations, ordered=False)
+
+    return True
+
+
 def add_exception_trading_dates_to_year(date):
     if isinstance(date, list):
-        data = db['collection_exception_trading_days'].find_one_and_update({"year": date[0].year},  
+        data = get_db()['collection_exception_trading_days'].find_one_and_update({"year": date[0].year},  
                                                              {"$push": {"dates": {"$each": date}},
                                                              "$set": {'updated_on': datetime.now()}},
                                                              upsert=True,
                                                              return_document=True
                                                              )
     else:
-        data = db['collection_exception_trading_days'].find_one_and_update({"year": date.year},  
+        data = get_db()['collection_exception_trading_days'].find_one_and_update({"year": date.year},  
                                                             {"$push": {"dates": date}, 
                                                             "$set": {'updated_on': datetime.now()}},
                                                             upsert=True,
@@ -147,5 +262,5 @@ def add_exception_trading_dates_to_year(date):
 
 
 def get_exception_trading_dates_to_year(year):
-    data = db['collection_exception_trading_days'].find_one({'year': year})
+    data = get_db()['collection_exception_trading_days'].find_one({'year': year})
     return data
\ No newline at end of file
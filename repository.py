@@ -0,0 +1,174 @@
+import copy
+import threading
+
+
+class PortfolioRepository:
+    '''
+    Storage used by the portfolio builder: index constituents, monthly portfolio documents,
+    the holiday calendar and the per-stock portfolio updates.
+
+    MongoRepository is the production implementation. InMemoryRepository keeps everything in
+    dicts, so portfolio construction and the indicators run with no database.
+    '''
+
+    def get_index_constituents(self, index):
+        raise NotImplementedError
+
+    def fetch_portfolio(self, collection_name, year, month):
+        raise NotImplementedError
+
+    def save_portfolio(self, collection_name, portfolio):
+        raise NotImplementedError
+
+    def get_holidays_for_year(self, year):
+        raise NotImplementedError
+
+    def get_exception_trading_dates_to_year(self, year):
+        raise NotImplementedError
+
+    def write_portfolio_updates(self, portfolio_fields, order_updates):
+        raise NotImplementedError
+
+
+class MongoRepository(PortfolioRepository):
+    '''
+    Repository backed by the queries module. queries (and pymongo) is only imported on the
+    first call, and the client only connects on the first query.
+    '''
+
+    @staticmethod
+    def _queries():
+        import queries
+        return queries
+
+    def get_index_constituents(self, index):
+        return self._queries().get_index_constituents(index)
+
+    def fetch_portfolio(self, collection_name, year, month):
+        return self._queries().fetch_portfolio(collection_name, year, month)
+
+    def save_portfolio(self, collection_name, portfolio):
+        return self._queries().save_portfolio(collection_name, portfolio)
+
+    def get_holidays_for_year(self, year):
+        return self._queries().get_holidays_for_year(year)
+
+    def get_exception_trading_dates_to_year(self, year):
+        return self._queries().get_exception_trading_dates_to_year(year)
+
+    def write_portfolio_updates(self, portfolio_fields, order_updates):
+        return self._queries().write_portfolio_updates(portfolio_fields, order_updates)
+
+
+class InMemoryRepository(PortfolioRepository):
+    '''
+    Repository kept in process memory, for tests, dry runs and backtests.
+
+    Parameters:
+    - constituents: Dict of {index: [stocks]}.
+    - portfolios: Dict of {(collection_name, year, month): portfolio document}.
+    - holidays: Dict of {year: [datetime]}.
+    - exception_trading_days: Dict of {year: [datetime]}.
+    '''
+
+    def __init__(self, constituents=None, portfolios=None, holidays=None, exception_trading_days=None):
+        self.constituents = constituents or {}
+        self.portfolios = portfolios or {}
+        self.holidays = holidays or {}
+        self.exception_trading_days = exception_trading_days or {}
+        self.orders = {}
+
+    def get_index_constituents(self, index):
+        return list(self.constituents[index])
+
+    def fetch_portfolio(self, collection_name, year, month):
+        return self.portfolios.get((collection_name, year, month))
+
+    def save_portfolio(self, collection_name, portfolio):
+        self.portfolios[(collection_name, portfolio['year'], portfolio['month'])] = copy.deepcopy(portfolio)
+        return True
+
+    def get_holidays_for_year(self, year):
+        if year not in self.holidays:
+            return None
+        return {'year': year, 'dates': self.holidays[year]}
+
+    def get_exception_trading_dates_to_year(self, year):
+        if year not in self.exception_trading_days:
+            return None
+        return {'year': year, 'dates': self.exception_trading_days[year]}
+
+    def write_portfolio_updates(self, portfolio_fields, order_updates):
+        for (strategy_name, year, month), stocks in portfolio_fields.items():
+            portfolio = self.portfolios.get((strategy_name, year, month))
+            if portfolio is None:
+                continue
+            for item in portfolio.get('df', {}).get('portfolio', []):
+                if item.get('stock') in stocks:
+                    item.update(stocks[item['stock']])
+
+        for order_id, to_update in order_updates.items():
+            self.orders.setdefault(order_id, {}).update(to_update)
+
+        return True
+
+
+_repository = None
+
+
+def get_repository():
+    '''
+    Returns the process wide repository, MongoRepository unless replaced with set_repository().
+    '''
+    global _repository
+    if _repository is None:
+        _repository = MongoRepository()
+    return _repository
+
+
+def set_repository(repository):
+    global _repository
+    _repository = repository
+
+
+class PortfolioUpdates:
+    '''
+    Unit of work for the per-stock changes made to portfolio documents and the order ledger
+    while executing a month's orders.
+
+    Changes are collected in memory (thread safe) and written by flush() through the
+    repository in one go (for Mongo, one bulk_write per (strategy, year, month) portfolio
+    document and one for the ledger) instead of a round trip per field and stock.
+    '''
+
+    def __init__(self, repository=None):
+        self._lock = threading.Lock()
+        self._portfolio_fields = {}
+        self._order_updates = {}
+        self.repository = repository
+
+    def set_portfolio_field(self, strategy_name, year, month, stock, field, value):
+        with self._lock:
+            document = self._portfolio_fields.setdefault((strategy_name, year, month), {})
+            document.setdefault(stock, {})[field] = value
+
+    def set_price(self, strategy_name, year, month, stock, price_type, price):
+        self.set_portfolio_field(strategy_name, year, month, stock, price_type, price)
+
+    def set_quantity(self, strategy_name, year, month, stock, quantity):
+        self.set_portfolio_field(strategy_name, year, month, stock, 'quantity', quantity)
+
+    def update_order(self, order_id, to_update):
+        with self._lock:
+            self._order_updates.setdefault(order_id, {}).update(to_update)
+
+    def flush(self):
+        with self._lock:
+            portfolio_fields, self._portfolio_fields = self._portfolio_fields, {}
+            order_updates, self._order_updates = self._order_updates, {}
+
+        if len(portfolio_fields) == 0 and len(order_updates) == 0:
+            return True
+
+        repository = self.repository or get_repository()
+        return repository.write_portfolio_updates(portfolio_fields, order_updates)
@@ -0,0 +1,35 @@
+import os
+
+_env_loaded = False
+
+
+def load_env():
+    '''
+    Loads the .env file into the environment, once per process.
+
+    Called where configuration is first needed (the entry points, the Mongo client) instead
+    of at import, so importing a module never reads the file system.
+    '''
+    global _env_loaded
+    if _env_loaded:
+        return True
+
+    from dotenv import find_dotenv, load_dotenv
+
+    dotenv_path = find_dotenv()
+    if dotenv_path:
+        load_dotenv(dotenv_path=dotenv_path, override=True)
+    else:
+        print("No .env file found")
+
+    _env_loaded = True
+    return True
+
+
+def get_env(key, default=None):
+    load_env()
+    return os.getenv(key, default)
+
+
+def get_index_list():
+    return get_env('INDEX_LIST').split(',')
@@ -0,0 +1,235 @@
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from backtest import run_backtest
+from settings import load_env, get_env
+from utils import STRATEGY_PARAMETERS, check_dataframes, load_and_set_data
+
+SWEEP_TOP_N = [5, 10, 15, 20, 25, 30]
+
+
+def build_grid(versions=None, lookback_months=[12], stop_loss_options=[(False, 0)]):
+    '''
+    Grid points of a sweep, one run_backtest call each (every top N is run inside one call).
+
+    Parameters:
+    - versions: Strategy versions of STRATEGY_PARAMETERS, all of them when None.
+    - lookback_months: Lookback windows to run.
+    - stop_loss_options: List of (price_tracking_enabled, stop_loss) pairs.
+    '''
+    grid = []
+    for version, lookback, (price_tracking_enabled, stop_loss) in itertools.product(
+            versions or list(STRATEGY_PARAMETERS), lookback_months, stop_loss_options):
+        parameters = STRATEGY_PARAMETERS[version]
+        grid.append({
+            'version': version,
+            'sorting_criteria': parameters['sorting_criteria'],
+            'absolute': parameters['absolute'],
+            'filters': parameters['filters'],
+            'lookback_months': lookback,
+            'price_tracking_enabled': price_tracking_enabled,
+            'stop_loss': stop_loss
+        })
+    return grid
+
+
+def share_matrices(data, volumes, shared_dir):
+    '''
+    Writes the price and volume matrices and the dates as .npy files in 'shared_dir', for the
+    workers to memory map read-only instead of receiving a pickled copy each.
+
+    Returns the description attach_shared_matrices takes.
+    '''
+    data, volumes, dates = check_dataframes(prices_df=data, volumes_df=volumes)
+    stocks = [col for col in data.columns if col != 'Date']
+
+    np.save(os.path.join(shared_dir, 'prices.npy'), data[stocks].to_numpy(dtype=np.float64))
+    np.save(os.path.join(shared_dir, 'volumes.npy'), volumes[stocks].to_numpy(dtype=np.float64))
+    np.save(os.path.join(shared_dir, 'dates.npy'), pd.to_datetime(dates).to_numpy(dtype='datetime64[ns]'))
+
+    return {'dir': shared_dir, 'stocks': stocks}
+
+
+_shared_data = None
+_shared_volumes = None
+_shared_prices = None
+
+
+def _frame_from_shared(values, stocks, dates):
+    frame = pd.DataFrame(values, columns=stocks, copy=False)
+    frame.insert(0, 'Date', dates)
+    return frame
+
+
+def attach_shared_matrices(shared):
+    '''
+    Process pool initializer: maps the shared matrices of share_matrices once per worker. The
+    frames wrap the read-only maps without copying them.
+    '''
+    global _shared_data, _shared_volumes, _shared_prices
+    dates = pd.to_datetime(np.load(os.path.join(shared['dir'], 'dates.npy')))
+    _shared_prices = np.load(os.path.join(shared['dir'], 'prices.npy'), mmap_mode='r')
+    volumes = np.load(os.path.join(shared['dir'], 'volumes.npy'), mmap_mode='r')
+    _shared_data = _frame_from_shared(_shared_prices, shared['stocks'], dates)
+    _shared_volumes = _frame_from_shared(volumes, shared['stocks'], dates)
+
+
+def _result_rows(point, dfs):
+    '''
+    One row per (top N, month) of a run_backtest result, with the run parameters as columns.
+    The '' / True / 'NEW' markers of the portfolio items are stored as booleans.
+    '''
+    rows = []
+    for item in dfs:
+        for month_result in item['df'].values():
+            rows.append({
+                'version': point['version'],
+                'sorting_criteria': point['sorting_criteria'],
+                'absolute': point['absolute'],
+                'lookback_months': point['lookback_months'],
+                'price_tracking_enabled': point['price_tracking_enabled'],
+                'stop_loss': point['stop_loss'],
+                'top_n': item['top_n'],
+                'year': month_result['year'],
+                'month': month_result['month'],
+                'first_trading_date': month_result['first_trading_date'],
+                'roll_over_trading_date': month_result['roll_over_trading_date'],
+                'last_trading_date': month_result['last_trading_date'],
+                'monthly_returns': month_result['monthly_returns'],
+                'top_n_scripts': month_result['top_n_scripts'],
+                'sl_triggered_scripts': month_result['sl_triggered_scripts'],
+                'new_added_scripts': month_result['new_added_scripts'],
+                'removed_scripts': month_result['removed_scripts'],
+                'carry_forward_scripts': month_result['carry_forward_scripts'],
+                'portfolio': [{
+                    'stock': stock['stock'],
+                    'initial_price': float(stock['initial_price']),
+                    'final_price': float(stock['final_price']),
+                    'returns': float(stock['returns']),
+                    'carry_forward': bool(stock['carry_forward']),
+                    'sl_triggered': stock['sl_triggered'] is True,
+                    'sl_trigger_date': stock['sl_trigger_date'],
+                    'is_new': stock['is_new'] == 'NEW'
+                } for stock in month_result['portfolio']]
+            })
+    return rows
+
+
+def _run_grid_point(point, start_year, start_month, end_year, end_month, top_n):
+    dfs = run_backtest(_shared_data, _shared_volumes,
+                       start_year=start_year, start_month=start_month, end_year=end_year, end_month=end_month,
+                       top_n=top_n,
+                       sorting_criteria=point['sorting_criteria'], absolute=point['absolute'],
+                       lookback_months=point['lookback_months'],
+                       price_tracking_enabled=point['price_tracking_enabled'], stop_loss=point['stop_loss'],
+                       filters=point['filters'], prices=_shared_prices)
+    return _result_rows(point, dfs)
+
+
+def run_sweep(data, volumes, grid,
+              start_year=2010, start_month=1, end_year=None, end_month=None,
+              top_n=SWEEP_TOP_N, output_path='sweep_results.parquet', max_workers=None):
+    '''
+    Runs run_backtest for every grid point (see build_grid) on a process pool and writes all
+    results to one Parquet file, one row per (grid point, top N, month).
+
+    The price and volume matrices are written once as .npy files and memory mapped read-only
+    by every worker, so they are not pickled per task. The mapped price matrix is passed to
+    run_backtest, whose indicators and returns read it instead of copying it out of the frame.
+    The indicator results (EMA, daily changes, scores) are still private to each worker.
+
+    Parameters:
+    - data, volumes: Price and volume DataFrames with a 'Date' column.
+    - grid: Grid points from build_grid.
+    - start_year, start_month, end_year, end_month: Months of every backtest.
+    - top_n: Portfolio sizes run at every grid point.
+    - output_path: Parquet results file, read back with load_sweep_results.
+    - max_workers: Process count, SWEEP_MAX_WORKERS or the CPU count when None.
+    '''
+    if max_workers is None:
+        max_workers = int(get_env('SWEEP_MAX_WORKERS', os.cpu_count() or 1))
+
+    shared_dir = tempfile.mkdtemp(prefix='sweep_')
+    rows = []
+    try:
+        shared = share_matrices(data, volumes, shared_dir)
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_shared_matrices,
+                                 initargs=(shared,)) as executor:
+            futures = {
+                executor.submit(_run_grid_point, point, start_year, start_month, end_year, end_month, top_n): point
+                for point in grid
+            }
+            for future in as_completed(futures):
+                point = futures[future]
+                rows.extend(future.result())
+                print(f"done: {point['version']}, lookback_months: {point['lookback_months']}, "
+                      f"price_tracking_enabled: {point['price_tracking_enabled']}, stop_loss: {point['stop_loss']}")
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    results = pd.DataFrame(rows)
+    results.to_parquet(output_path, index=False)
+    return results
+
+
+def load_sweep_results(file_path, version, lookback_months=12, price_tracking_enabled=False, stop_loss=0, top_n=None):
+    '''
+    Reads one grid point of a sweep results file back into the list create_excel and
+    create_summary_data_frame take: [{'df': {f'{month}_{year}': month result}, 'top_n': N,
+    'sheet_name': f'Top_{N}'}], in 'top_n' order (all sizes of the grid point when None).
+    '''
+    results = pd.read_parquet(file_path)
+    results = results[(results['version'] == version) &
+                      (results['lookback_months'] == lookback_months) &
+                      (results['price_tracking_enabled'] == price_tracking_enabled) &
+                      (results['stop_loss'] == stop_loss)]
+
+    if len(results) == 0:
+        raise ValueError(f'No sweep results for version: {version}, lookback_months: {lookback_months}, '
+                         f'price_tracking_enabled: {price_tracking_enabled}, stop_loss: {stop_loss}')
+
+    if top_n is None:
+        top_n = sorted(results['top_n'].unique())
+
+    dfs = []
+    for n in top_n:
+        month_wise_returns = {}
+        for row in results[results['top_n'] == n].sort_values(['year', 'month']).to_dict('records'):
+            month_wise_returns[f"{row['month']}_{row['year']}"] = {
+                'year': row['year'],
+                'month': row['month'],
+                'first_trading_date': row['first_trading_date'],
+                'roll_over_trading_date': row['roll_over_trading_date'],
+                'last_trading_date': row['last_trading_date'],
+                'monthly_returns': row['monthly_returns'],
+                'top_n_scripts': list(row['top_n_scripts']),
+                'sl_triggered_scripts': list(row['sl_triggered_scripts']),
+                'new_added_scripts': list(row['new_added_scripts']),
+                'removed_scripts': list(row['removed_scripts']),
+                'carry_forward_scripts': list(row['carry_forward_scripts']),
+                'portfolio': [{
+                    **stock,
+                    'sl_triggered': True if stock['sl_triggered'] else '',
+                    'is_new': 'NEW' if stock['is_new'] else ''
+                } for stock in row['portfolio']]
+            }
+        dfs.append({'df': month_wise_returns, 'top_n': n, 'sheet_name': f'Top_{n}'})
+
+    return dfs
+
+
+if __name__ == '__main__':
+    load_env()
+    data = load_and_set_data(file_path="NSE_PRICE_DATA.csv", data_type='PRICE')
+    volumes = load_and_set_data(file_path="NSE_VOLUME_DATA.csv", data_type='VOLUME')
+    start = time.time()
+    run_sweep(data, volumes, build_grid(lookback_months=[6, 9, 12], stop_loss_options=[(False, 0), (True, 10)]))
+    print(f'sweep done in {time.time() - start:.1f}s')
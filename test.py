@@ -4,24 +4,15 @@ from datetime import datetime as dt
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 
-from dotenv import find_dotenv, load_dotenv
-import os
-
 from queries import get_index_constituents, fetch_portfolio
 from fetch_prices import *
+from price_store import read_store
+from settings import get_index_list
 
 # from nsetools import Nse
 from nsepython import *
 
-dotenv_path = find_dotenv()
-
-if dotenv_path:
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-else:
-    print("No .env file found")
-
 STRATEGIES = ['V1', 'V2', 'V3','V4']
-INDEX_LIST = os.getenv('INDEX_LIST').split(',')
 
 def create_stock_price_df():
     """
@@ -40,7 +31,7 @@ def create_stock_price_df():
     today = dt(year=2025, month=2, day=1)
     # order_placement_datetime = dt.combine(today.date(), time(hour=9, minute=17, second=0))
 
-    for index in INDEX_LIST:
+    for index in get_index_list():
         stock_list.extend(get_index_constituents(index))
 
     stock_list = list(set(stock_list))
@@ -53,7 +44,7 @@ def create_stock_price_df():
     # Now create DataFrame from the 'data' list
     df = pd.DataFrame(data)
 
-    last_row = pd.read_csv("NSE_PRICE_DATA.csv").iloc[-1]
+    last_row = read_store("NSE_PRICE_DATA.csv", columns=stock_list).iloc[-1]
     transposed_row = last_row.transpose()
     subset = transposed_row[stock_list]
     df['closing_prices'] = subset.values
@@ -95,7 +86,7 @@ def test(symbol):
 def create_sheet(year, month):
     df1 = pd.DataFrame()
     stock_list = []
-    for index in INDEX_LIST:
+    for index in get_index_list():
         for st in STRATEGIES:
             df = fetch_portfolio(collection_name=f"{st}_{index}", year=year, month=month)
             for stock in df['df']['portfolio']:
@@ -130,4 +121,5 @@ def create_sheet(year, month):
     df = pd.DataFrame(stock_list)
     df.to_excel('portfolio_JUN.xlsx')
 
-create_sheet(year=2025, month=6)
\ No newline at end of file
+if __name__ == '__main__':
+    create_sheet(year=2025, month=6)
@@ -0,0 +1,5 @@
+from benchmark import check_forbidden_imports
+
+
+def test_forbidden_imports():
+    assert check_forbidden_imports()
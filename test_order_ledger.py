@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import queries
+from monthly_orders import create_orders
+from trading_calendar import TradingCalendar, set_trading_calendar
+
+
+@pytest.fixture
+def ledger_db(monkeypatch):
+    db = mongomock.MongoClient()['momentum']
+    monkeypatch.setattr(queries, 'get_db', lambda: db)
+    monkeypatch.setattr(queries, '_order_ledger_indexes_ensured', False)
+    set_trading_calendar(TradingCalendar(holiday_loader=lambda year: [], exception_loader=lambda year: []))
+    yield db
+    set_trading_calendar(None)
+
+
+def make_month_portfolio(buy_stocks, sell_stocks):
+    return {
+        'year': 2025,
+        'month': 6,
+        'df': {
+            'buy_order': [{'stock': stock, 'order_quantity': None} for stock in buy_stocks],
+            'sell_order': [{'stock': stock, 'order_quantity': 10} for stock in sell_stocks]
+        },
+        'stock_num': 3,
+        'created_on': datetime(2025, 6, 2)
+    }
+
+
+def test_create_orders_retry_is_idempotent(ledger_db):
+    month_portfolio = make_month_portfolio(['AAA', 'BBB', 'CCC'], ['DDD', 'EEE'])
+
+    create_orders(strategy_version='V1', index='NIFTY_50', collection_name='V1_NIFTY_50', month_portfolio=month_portfolio)
+    create_orders(strategy_version='V1', index='NIFTY_50', collection_name='V1_NIFTY_50', month_portfolio=month_portfolio)
+
+    order_ids = [order['order_id'] for order in ledger_db['collection_orders'].find()]
+    assert len(order_ids) == 5
+    assert len(set(order_ids)) == len(order_ids)
+
+
+def test_retry_of_partially_written_batch_inserts_only_missing_orders(ledger_db):
+    create_orders(strategy_version='V1', index='NIFTY_50', collection_name='V1_NIFTY_50',
+                  month_portfolio=make_month_portfolio(['AAA'], []))
+    create_orders(strategy_version='V1', index='NIFTY_50', collection_name='V1_NIFTY_50',
+                  month_portfolio=make_month_portfolio(['AAA', 'BBB'], ['DDD']))
+
+    stocks = sorted(order['stock'] for order in ledger_db['collection_orders'].find())
+    assert stocks == ['AAA', 'BBB', 'DDD']
+
+
+def test_ledger_indexes(ledger_db):
+    queries.ensure_order_ledger_indexes()
+
+    index_information = ledger_db['collection_orders'].index_information()
+    order_id_indexes = [index for index in index_information.values() if index['key'] == [('order_id', 1)]]
+    assert len(order_id_indexes) == 1
+    assert order_id_indexes[0].get('unique') is True
+    assert 'pending_orders_by_date' in index_information
+
+    ledger_db['collection_orders'].insert_one({'order_id': 'order-1'})
+    with pytest.raises(DuplicateKeyError):
+        ledger_db['collection_orders'].insert_one({'order_id': 'order-1'})
+
+
+class FailingCollection:
+    def __init__(self, code):
+        self.code = code
+
+    def insert_many(self, orders, ordered=True):
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': self.code, 'errmsg': 'write failed'}],
+                              'nInserted': 0})
+
+
+def test_non_duplicate_write_errors_are_raised(monkeypatch):
+    monkeypatch.setattr(queries, 'get_db', lambda: {'collection_orders': FailingCollection(code=121)})
+    monkeypatch.setattr(queries, '_order_ledger_indexes_ensured', True)
+
+    with pytest.raises(BulkWriteError):
+        queries.add_orders_to_ledger([{'order_id': 'order-1'}])
+
+
+def test_duplicate_write_errors_are_skipped(monkeypatch):
+    monkeypatch.setattr(queries, 'get_db', lambda: {'collection_orders': FailingCollection(code=11000)})
+    monkeypatch.setattr(queries, '_order_ledger_indexes_ensured', True)
+
+    assert queries.add_orders_to_ledger([{'order_id': 'order-1'}]) == 0
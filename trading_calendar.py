@@ -0,0 +1,153 @@
+import calendar
+import json
+from datetime import date, datetime, timedelta
+
+from repository import get_repository
+from settings import get_env
+
+
+def _dates_from_document(document):
+    if document is None:
+        return []
+    return [d.date() for d in set(document['dates'])]
+
+
+def load_holidays_from_db(year):
+    return _dates_from_document(get_repository().get_holidays_for_year(year))
+
+
+def load_exception_trading_days_from_db(year):
+    return _dates_from_document(get_repository().get_exception_trading_dates_to_year(year))
+
+
+def _to_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+class TradingCalendar:
+    '''
+    Trading calendar of the exchange: weekdays that are not holidays, plus exception
+    trading days (special sessions on a weekend or holiday).
+
+    Holidays and exception days are loaded once per year through the given loaders and the
+    whole year is precomputed, so every lookup afterwards is a dict access.
+
+    Parameters:
+    - holiday_loader: Callable taking a year and returning a list of holiday dates.
+    - exception_loader: Callable taking a year and returning a list of exception trading dates.
+    '''
+
+    def __init__(self, holiday_loader=None, exception_loader=None):
+        self.holiday_loader = holiday_loader or load_holidays_from_db
+        self.exception_loader = exception_loader or load_exception_trading_days_from_db
+        self._years = {}
+
+    @classmethod
+    def from_holiday_file(cls, file_path):
+        '''
+        Calendar backed by a local JSON file instead of the database, e.g.
+        {"holidays": ["2025-02-26", ...], "exception_trading_days": ["2025-02-01"]}.
+        '''
+        with open(file_path, 'r') as holiday_file:
+            stored = json.load(holiday_file)
+
+        holidays = [datetime.strptime(d, '%Y-%m-%d').date() for d in stored.get('holidays', [])]
+        exception_days = [datetime.strptime(d, '%Y-%m-%d').date() for d in stored.get('exception_trading_days', [])]
+
+        return cls(holiday_loader=lambda year: [d for d in holidays if d.year == year],
+                   exception_loader=lambda year: [d for d in exception_days if d.year == year])
+
+    def _year(self, year):
+        if year in self._years:
+            return self._years[year]
+
+        holidays = set(self.holiday_loader(year))
+        exception_days = set(self.exception_loader(year))
+
+        days = []
+        current_date = date(year, 1, 1)
+        while current_date.year == year:
+            days.append(current_date)
+            current_date += timedelta(days=1)
+
+        is_trading = {d: d in exception_days or (d.weekday() < 5 and d not in holidays) for d in days}
+
+        # For every calendar day, the first trading day at or after it and the last one at or before it
+        next_trading = {}
+        upcoming = None
+        for d in reversed(days):
+            upcoming = d if is_trading[d] else upcoming
+            next_trading[d] = upcoming
+
+        previous_trading = {}
+        latest = None
+        for d in days:
+            latest = d if is_trading[d] else latest
+            previous_trading[d] = latest
+
+        self._years[year] = {
+            'is_trading': is_trading,
+            'next_trading': next_trading,
+            'previous_trading': previous_trading
+        }
+        return self._years[year]
+
+    def is_trading_day(self, day):
+        day = _to_date(day)
+        return self._year(day.year)['is_trading'][day]
+
+    def next_trading_day(self, day, include_day=False):
+        '''
+        First trading day after 'day', or at 'day' if 'include_day' and it is a trading day.
+        '''
+        day = _to_date(day)
+        if not include_day:
+            day += timedelta(days=1)
+
+        next_day = self._year(day.year)['next_trading'][day]
+        if next_day is None:
+            return self.next_trading_day(date(day.year + 1, 1, 1), include_day=True)
+        return next_day
+
+    def previous_trading_day(self, day, include_day=False):
+        '''
+        Last trading day before 'day', or at 'day' if 'include_day' and it is a trading day.
+        '''
+        day = _to_date(day)
+        if not include_day:
+            day -= timedelta(days=1)
+
+        previous_day = self._year(day.year)['previous_trading'][day]
+        if previous_day is None:
+            return self.previous_trading_day(date(day.year - 1, 12, 31), include_day=True)
+        return previous_day
+
+    def first_trading_day(self, year, month):
+        return self.next_trading_day(date(year, month, 1), include_day=True)
+
+    def last_trading_day(self, year, month):
+        month_end = date(year, month, calendar.monthrange(year, month)[1])
+        return self.previous_trading_day(month_end, include_day=True)
+
+
+_trading_calendar = None
+
+
+def get_trading_calendar():
+    '''
+    Returns the process wide calendar, created on first use. Backed by the local file in
+    HOLIDAY_FILE when set, else by the holiday collections in the database.
+    '''
+    global _trading_calendar
+    if _trading_calendar is None:
+        holiday_file = get_env('HOLIDAY_FILE')
+        _trading_calendar = TradingCalendar.from_holiday_file(holiday_file) if holiday_file else TradingCalendar()
+    return _trading_calendar
+
+
+def set_trading_calendar(trading_calendar):
+    '''
+    Replaces the process wide calendar, e.g. with one built from a local holiday file in tests.
+    '''
+    global _trading_calendar
+    _trading_calendar = trading_calendar
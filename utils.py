@@ -4,17 +4,13 @@ import numpy as np
 from datetime import timedelta, datetime
 import calendar
 import json
-from dotenv import load_dotenv, find_dotenv
-import os
 import traceback
 
-from queries import (get_index_constituents, get_holidays_for_year, 
-                     update_price_in_portfolio, get_exception_trading_dates_to_year,
-                     fetch_portfolio)
-
-dotenv_path = find_dotenv()
-load_dotenv(dotenv_path=dotenv_path, override=True)
-nifty_500_csv = os.getenv('nifty_500_data')
+from repository import get_repository, PortfolioUpdates
+from trading_calendar import get_trading_calendar
+from price_store import read_store, read_store_columns
+from settings import get_env
+from eligibility import AsOfSnapshot, select_eligible, DEFAULT_FILTERS
 
 month_abbreviations = {
         1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun',
@@ -36,18 +32,27 @@ TOP_N_STOCKS = {
     'NSE': 100
 }
 
-def load_and_set_data(file_path, data_type='PRICE'):
+# 'filters' is the eligibility filter config of the strategy, see eligibility.get_filters
+STRATEGY_PARAMETERS = {
+    'V1': {'sorting_criteria': 'ttm', 'absolute': False, 'filters': DEFAULT_FILTERS},
+    'V2': {'sorting_criteria': 'm_score', 'absolute': False, 'filters': DEFAULT_FILTERS},
+    'V3': {'sorting_criteria': 'm_score', 'absolute': True, 'filters': DEFAULT_FILTERS},
+    'V4': {'sorting_criteria': 'c_score', 'absolute': False, 'filters': DEFAULT_FILTERS},
+}
+
+def load_and_set_data(file_path, data_type='PRICE', columns=None):
     '''
-    This function loads a CSV file, removes unnamed/blank columns, checks for the 'Date' column,
-    processes the 'Date' column, and returns a DataFrame.
+    This function loads price/volume data from the columnar store of a CSV file (see price_store),
+    removes unnamed/blank columns, checks for the 'Date' column, processes the 'Date' column, and returns a DataFrame.
 
     Returns one pandas objects: a DataFrame.
 
     Parameters:
     - file_path: Path to the CSV file.
+    - columns: Optional list of stock columns to load, all columns when None.
     '''
     try:
-        data = pd.read_csv(file_path)
+        data = read_store(file_path, columns=columns)
         # print("data columns on load: ", list(data.columns))
         # print("length data columns on load: ", len(list(data.columns)))
         # print("data rowc count: ", len(data))
@@ -135,34 +140,52 @@ def check_dataframes(prices_df, volumes_df):
     return prices_df, volumes_df, common_dates
 
 
+def forward_fill_array(values):
+    """
+    Forward fill NaN values down every column of a 2D float array in one vectorized pass.
+    NaN values before the first valid value of a column remain untouched.
+
+    Parameters:
+    values (np.ndarray): 2D float array, rows are dates and columns are stocks.
+
+    Returns:
+    np.ndarray: New array with NaN values forward filled.
+    """
+    valid = ~np.isnan(values)
+    source_rows = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(source_rows, axis=0, out=source_rows)
+    return np.take_along_axis(values, source_rows, axis=0)
+
+
 def front_fill_stock_prices_new(df):
     """
     Front-fill missing stock prices in the DataFrame up to March 28, 2024, starting from the first occurrence 
     of a non-zero value.
 
     Parameters:
-    df (pd.DataFrame): DataFrame containing stock prices with dates as index and stock names as columns.
+    df (pd.DataFrame): DataFrame containing stock prices with a 'Date' column and stock names as columns.
     
     Returns:
     pd.DataFrame: DataFrame with front-filled stock prices up to March 28, 2024.
     """
-    # Ensure 'Date' column is set as index
-    df.set_index('Date', inplace=True)
-
     # Define the date limit for forward-filling
     date_limit = pd.Timestamp('2024-03-28')
 
+    stocks = [col for col in df.columns if col != 'Date']
+
     # Replace 0 with NaN to handle forward fill correctly
-    df = df.replace(0, pd.NA)
+    prices = df[stocks].to_numpy(dtype=np.float64)
+    prices[prices == 0] = np.nan
 
-    # Apply forward-fill up to the specified date
-    filled_df = df.apply(lambda x: x[:date_limit].ffill().combine_first(x))
+    # Forward-fill only the rows up to the specified date
+    capped = (df['Date'] <= date_limit).to_numpy()
+    prices[capped] = forward_fill_array(prices[capped])
 
     # Replace NaN back with 0 after filling
-    filled_df = filled_df.fillna(0)
+    prices[np.isnan(prices)] = 0
 
-    # Reset index to have 'Date' as a column again
-    filled_df.reset_index(inplace=True)
+    filled_df = pd.DataFrame(prices, columns=stocks)
+    filled_df.insert(0, 'Date', df['Date'].to_numpy())
     return filled_df
 
 
@@ -171,23 +194,25 @@ def front_fill_stock_prices(df):
     Front-fill missing stock prices in the DataFrame starting from the first occurrence of a non-zero value.
     
     Parameters:
-    df (pd.DataFrame): DataFrame containing stock prices with dates as index and stock names as columns.
+    df (pd.DataFrame): DataFrame containing stock prices with a 'Date' column and stock names as columns.
     
     Returns:
     pd.DataFrame: DataFrame with front-filled stock prices.
     """
-    df.set_index('Date', inplace=True)
+    stocks = [col for col in df.columns if col != 'Date']
 
     # Replace 0 with NaN to handle the forward fill correctly
-    df = df.replace(0, pd.NA)
-    
-    # Forward fill the missing values
-    filled_df = df.apply(lambda x: x.ffill())
-    
+    prices = df[stocks].to_numpy(dtype=np.float64)
+    prices[prices == 0] = np.nan
+
+    # Forward fill the missing values of every stock at once
+    prices = forward_fill_array(prices)
+
     # Replace NaN back with 0 if needed after filling
-    filled_df = filled_df.fillna(0)
+    prices[np.isnan(prices)] = 0
 
-    filled_df.reset_index(inplace=True)
+    filled_df = pd.DataFrame(prices, columns=stocks)
+    filled_df.insert(0, 'Date', df['Date'].to_numpy())
     return filled_df
 
 
@@ -202,15 +227,19 @@ def back_fill_stock_prices(df):
     Returns:
     pd.DataFrame: DataFrame with NaN values backfilled after the first valid value in each column.
     """
-    df.set_index('Date', inplace=True)
-    for col in df.columns:
-        # Find the first valid (non-NaN) index
-        first_valid_index = df[col].first_valid_index()
-        if first_valid_index is not None:
-            # Apply bfill only from the first valid index onward
-            df.loc[first_valid_index:, col] = df.loc[first_valid_index:, col].bfill()
-    filled_df = df.fillna(0)
-    filled_df.reset_index(inplace=True)
+    stocks = [col for col in df.columns if col != 'Date']
+    prices = df[stocks].to_numpy(dtype=np.float64)
+
+    # Rows at or after the first valid value of each column
+    started = np.maximum.accumulate(~np.isnan(prices), axis=0)
+
+    # A backfill is a forward fill of the reversed rows
+    backfilled = forward_fill_array(prices[::-1])[::-1]
+    prices = np.where(started, backfilled, 0)
+    prices[np.isnan(prices)] = 0
+
+    filled_df = pd.DataFrame(prices, columns=stocks)
+    filled_df.insert(0, 'Date', df['Date'].to_numpy())
     return filled_df
 
 
@@ -225,27 +254,7 @@ def filter_dates_by_month(dates_sorted, start_date, end_date):
 
 
 def get_first_trading_date(year, month):
-
-    holiday_dates = get_holidays_for_year(year)
-    exception_trading_dates = get_exception_trading_dates_to_year(year)
-
-    if holiday_dates is None:
-        holiday_dates = []
-    else:
-        holiday_dates = [d.date() for d in list(set(holiday_dates['dates']))]
-
-    if exception_trading_dates is None:
-        exception_trading_dates = []
-    else:
-        exception_trading_dates = [d.date() for d in list(set(exception_trading_dates['dates']))]
-    
-
-    current_date = datetime(year, month, 1).date()
-
-    while True:
-        if (current_date in exception_trading_dates) or ((calendar.day_abbr[current_date.weekday()] not in ['Sat', 'Sun']) and (current_date not in holiday_dates)):
-            return current_date
-        current_date += timedelta(days=1)
+    return get_trading_calendar().first_trading_day(year, month)
 
 
 def get_trading_dates(dates_sorted, year, month):
@@ -260,23 +269,17 @@ def get_trading_dates(dates_sorted, year, month):
 
 
 def get_top_n_scripts(data, volumes, ema, first_trading_date, roll_over_trading_date, all_scripts, number_of_stocks, filters):
-    filtered_stocks = all_scripts
-    print('@@@@@@@@@@@@@@')
-    print('first_trading_date: ',first_trading_date)
-    print('rollover_trading_date: ',roll_over_trading_date)
-    print(f'get_top_n process_id: {os.getpid()}')
-    for filter_func in filters:
-        print('filtername: ',str(filter_func), 
-              f"process_id: {os.getpid()}", 
-              f"top n: {number_of_stocks}, rollover_trading_date: {roll_over_trading_date}")
-        filtered_stocks = list(filter(
-            lambda stock: filter_func(data, volumes, ema, stock, roll_over_trading_date),
-            filtered_stocks))
-        print('number of scripts filtered: ', len(filtered_stocks))
-        print('####################')
-    print('no of scripts filtered final: ',len(filtered_stocks))
-    print('@@@@@@@@@@@@@@')
-    return filtered_stocks[:number_of_stocks]
+    '''
+    Returns the first 'number_of_stocks' scripts (in ranked order) passing every eligibility filter.
+
+    The filter inputs (price, EMA, 52 week high, average traded value at the rollover date) come
+    from one AsOfSnapshot, and 'filters' is a filter config of the eligibility registry
+    (see eligibility.get_filters), each filter a vectorized mask.
+    Candidates are walked in rank order and the walk stops at N survivors, see
+    eligibility.select_eligible; per-filter rejection counts go to its report hook.
+    '''
+    snapshot = AsOfSnapshot(data, volumes, ema, roll_over_trading_date)
+    return select_eligible(snapshot, all_scripts, number_of_stocks, filters)
 
 
 def calculate_monthly_returns(data, last_trading_date, roll_over_trading_date, top_n_scripts):
@@ -386,6 +389,7 @@ def update_stock_list(data, dates, stocks,
 
     carry_forward_amount = 0
     stock_list = []
+    portfolio_updates = PortfolioUpdates()
     for stock in stocks:
         stock_dict = {
             "stock": stock,
@@ -415,8 +419,8 @@ def update_stock_list(data, dates, stocks,
                 # initial_price = next(filter(lambda x: x["stock"] == stock, last_month_portfolio),{}).get("final_price", 0)
                 quantity = next(filter(lambda x: x["stock"] == stock, last_month_portfolio),{}).get("quantity", 0)
                 last_returns = ((initial_price/next(filter(lambda x: x["stock"] == stock, last_month_portfolio),{}).get("initial_price", 0))-1)*100
-                update_price_in_portfolio(db_collection_name, roll_over_trading_date.year, roll_over_trading_date.month, stock, 'final_price', initial_price)
-                update_price_in_portfolio(db_collection_name, roll_over_trading_date.year, roll_over_trading_date.month, stock, 'returns', last_returns)
+                portfolio_updates.set_price(db_collection_name, roll_over_trading_date.year, roll_over_trading_date.month, stock, 'final_price', initial_price)
+                portfolio_updates.set_price(db_collection_name, roll_over_trading_date.year, roll_over_trading_date.month, stock, 'returns', last_returns)
                 # if final_price is not None and quantity is not None:
                 carry_forward_amount += (round(initial_price,2)*round(quantity))
                 # if final_price == 0:
@@ -438,6 +442,8 @@ def update_stock_list(data, dates, stocks,
 
         stock_list.append(stock_dict)
 
+    portfolio_updates.flush()
+
     return stock_list, carry_forward_amount
 
 
@@ -693,7 +699,7 @@ def create_nifty_df(df, start_year, start_month, end_year, end_month):
 
 def create_summary_data_frame(month_wise_returns, start_year=2010, start_month=1, end_year=2024, end_month = 3, version='', end_months={2024: 3}, top_n_values=[5, 10, 15, 20, 25, 30]):
     # Load Nifty data dynamically
-    nifty_df = pd.read_csv(f"{nifty_500_csv}")
+    nifty_df = pd.read_csv(f"{get_env('nifty_500_data')}")
     
     # Dynamically create column names based on top_n_values
     returns_columns = [f'Returns_(Top_{n})_{version}' for n in top_n_values]
@@ -1030,7 +1036,55 @@ def is_first_trading_day_of_month(date):
     return date.date() == d
 
 
-def get_filtered_data_based_on_index(data,  index):
+def get_index_columns(index):
+    '''
+    Returns the stock columns to load from the price store for an index: its constituents,
+    or None (every column) for the whole 'NSE' universe.
+    '''
+    if index == 'NSE':
+        return None
+
+    return get_repository().get_index_constituents(index)
+
+
+def load_data_for_indices(index_list, price_file_path="NSE_PRICE_DATA.csv", volume_file_path="NSE_VOLUME_DATA.csv"):
+    '''
+    Loads the price and volume data of every index in 'index_list' with one read of each store:
+    the whole universe when 'NSE' is in the list, else the union of the constituents present in
+    both stores. Each index is then taken out with get_filtered_data_based_on_index.
+
+    An index with constituents missing from the loaded data is reported with its missing symbols
+    and left out of 'constituents', so callers skip it while the other indices still run.
+
+    Returns (data, volumes, constituents), 'constituents' a dict of {index: get_index_columns(index)}.
+    '''
+    constituents = {index: get_index_columns(index) for index in index_list}
+
+    columns = None
+    if 'NSE' not in index_list:
+        stored_columns = set(read_store_columns(price_file_path)) & set(read_store_columns(volume_file_path))
+        columns = [stock for stock in dict.fromkeys(stock for index in index_list for stock in constituents[index])
+                   if stock in stored_columns]
+
+    data = load_and_set_data(file_path=price_file_path, data_type='PRICE', columns=columns)
+    volumes = load_and_set_data(file_path=volume_file_path, data_type='VOLUME', columns=columns)
+    if data is None or volumes is None:
+        return data, volumes, constituents
+
+    loaded_columns = set(data.columns) & set(volumes.columns)
+    for index in index_list:
+        if constituents[index] is None:
+            continue
+
+        missing = [stock for stock in constituents[index] if stock not in loaded_columns]
+        if missing:
+            print(f'Skipping {index}, {len(missing)} constituents missing from the price/volume data: {missing}')
+            del constituents[index]
+
+    return data, volumes, constituents
+
+
+def get_filtered_data_based_on_index(data,  index, constituents=None):
 
     scrips = []
     if index == 'NSE':
@@ -1041,7 +1095,7 @@ def get_filtered_data_based_on_index(data,  index):
                         if "BEES" not in c:
                             scrips.append(c)
     else:
-        stocks = get_index_constituents(index)
+        stocks = constituents if constituents is not None else get_repository().get_index_constituents(index)
         scrips = ['Date']
         scrips.extend(stocks)
 
@@ -1050,7 +1104,7 @@ def get_filtered_data_based_on_index(data,  index):
 
 
 def get_cash_balance(strategy_name, year, month):
-    last_month_df = fetch_portfolio(collection_name=strategy_name, 
+    last_month_df = get_repository().fetch_portfolio(collection_name=strategy_name, 
                                                 year= year,
                                                 month= month)
     if last_month_df is None: